@@ -0,0 +1,231 @@
+# Imports
+import os
+import threading
+
+from core.logger import logger
+
+class NullBackend:
+    """
+    A backend without any window or GL context, for CPU-only benchmarks of the
+    scheduler and mesh pipeline. Nothing GL related may be scheduled with it.
+    """
+
+    gl = False
+
+    def __init__(self, width=800, height=800, title="Untitled") -> None:
+        self.width = width
+        self.height = height
+        self.on_event = lambda: None # Called for every input or window event
+        self.woken = threading.Event()
+
+    def make_current(self) -> None: pass
+    def make_shared_current(self) -> None: pass
+    def release_current(self) -> None: pass
+    def swap_buffers(self) -> None: pass
+    def poll_events(self) -> None: pass
+    def should_close(self) -> bool: return False
+    def set_swap_interval(self, interval) -> None: pass
+    def destroy(self) -> None: pass
+
+    def wait_events(self, timeout) -> None:
+        """
+        No events can arrive, so this sleeps until the timeout or a wake()
+        """
+        self.woken.wait(timeout)
+        self.woken.clear()
+
+    def wake(self) -> None:
+        """
+        Make wait_events() return early, callable from any thread
+        """
+        self.woken.set()
+
+    @property
+    def framebuffer_size(self) -> tuple: return self.width, self.height
+
+    @property
+    def size(self) -> tuple: return self.width, self.height
+
+class GLFWBackend:
+    """
+    A visible GLFW window, plus an invisible one sharing its GL objects for the update thread
+    """
+
+    gl = True
+
+    def __init__(self, width=800, height=800, title="Untitled") -> None:
+        """
+        Create the windows, GLFW wants this done on the main thread
+        """
+        import glfw
+        self.glfw = glfw
+
+        # Throw an exception if glfw does not initialize
+        if not glfw.init():
+            raise Exception('[core/Window] Could not initialize GLFW!')
+
+        # Create the window
+        self.window = glfw.create_window(width, height, title, None, None)
+
+        # Create an invisible window sharing its GL objects with the main one.
+        # GLFW wants windows created on the main thread, the worker only makes it current.
+        glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+        self.shared_window = glfw.create_window(1, 1, "Shared Context", None, self.window)
+        glfw.default_window_hints()
+        glfw.make_context_current(self.window)
+
+        # Report every input and window event, so an idle window knows when to redraw
+        self.on_event = lambda: None
+        for setter in (
+            glfw.set_key_callback, glfw.set_char_callback, glfw.set_mouse_button_callback,
+            glfw.set_cursor_pos_callback, glfw.set_scroll_callback, glfw.set_framebuffer_size_callback,
+            glfw.set_window_refresh_callback, glfw.set_window_focus_callback,
+        ):
+            setter(self.window, lambda *args: self.on_event())
+
+    def make_current(self) -> None: self.glfw.make_context_current(self.window)
+    def make_shared_current(self) -> None: self.glfw.make_context_current(self.shared_window)
+    def release_current(self) -> None: self.glfw.make_context_current(None)
+    def swap_buffers(self) -> None: self.glfw.swap_buffers(self.window)
+    def poll_events(self) -> None: self.glfw.poll_events()
+    def wait_events(self, timeout) -> None: self.glfw.wait_events_timeout(timeout)
+    def wake(self) -> None: self.glfw.post_empty_event()
+    def should_close(self) -> bool: return self.glfw.window_should_close(self.window)
+    def set_swap_interval(self, interval) -> None: self.glfw.swap_interval(interval)
+
+    def destroy(self) -> None:
+        self.glfw.destroy_window(self.shared_window)
+        self.glfw.destroy_window(self.window)
+        self.glfw.terminate()
+
+    @property
+    def framebuffer_size(self) -> tuple: return self.glfw.get_framebuffer_size(self.window)
+
+    @property
+    def size(self) -> tuple: return self.glfw.get_window_size(self.window)
+
+class OffscreenBackend(NullBackend):
+    """
+    Base of the GL backends without a display: rendering goes to an offscreen surface,
+    a second context shares its objects for the update thread, and the window never closes by itself.
+    PyOpenGL picks its platform on the first import, so PYOPENGL_PLATFORM has to be set
+    before anything imports OpenGL, e.g. in the environment of the benchmark.
+    """
+
+    gl = True
+    platform = None
+
+    def __init__(self, width=800, height=800, title="Untitled") -> None:
+        super().__init__(width, height, title)
+        if os.environ.get("PYOPENGL_PLATFORM") != self.platform:
+            raise Exception(f'[core/Window] The {self.platform} backend needs PYOPENGL_PLATFORM={self.platform} set before OpenGL is imported!')
+
+class EGLBackend(OffscreenBackend):
+    """
+    Offscreen rendering into an EGL pbuffer, works headless with Mesa (llvmpipe) or a GPU driver
+    """
+
+    platform = "egl"
+
+    def __init__(self, width=800, height=800, title="Untitled") -> None:
+        super().__init__(width, height, title)
+        from OpenGL import EGL
+        self.egl = EGL
+
+        # Without a display server, have Mesa skip X11/Wayland and render surfaceless
+        if not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+            os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, major, minor):
+            raise Exception('[core/Window] Could not initialize EGL!')
+
+        attributes = [
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8, EGL.EGL_ALPHA_SIZE, 8,
+            EGL.EGL_DEPTH_SIZE, 24,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE,
+        ]
+        configs = (EGL.EGLConfig * 1)()
+        count = EGL.EGLint()
+        if not EGL.eglChooseConfig(self.display, (EGL.EGLint * len(attributes))(*attributes), configs, 1, count) or not count.value:
+            raise Exception('[core/Window] No suitable EGL config!')
+        config = configs[0]
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+        def surface(width, height):
+            size = [EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE]
+            return EGL.eglCreatePbufferSurface(self.display, config, (EGL.EGLint * len(size))(*size))
+
+        self.surface = surface(width, height)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, None)
+        self.shared_surface = surface(1, 1)
+        self.shared_context = EGL.eglCreateContext(self.display, config, self.context, None)
+        if not self.context or not self.shared_context:
+            raise Exception('[core/Window] Could not create the EGL contexts!')
+        self.make_current()
+        logger.info('[core/Window] Rendering offscreen with EGL')
+
+    def make_current(self) -> None:
+        self.egl.eglMakeCurrent(self.display, self.surface, self.surface, self.context)
+
+    def make_shared_current(self) -> None:
+        self.egl.eglMakeCurrent(self.display, self.shared_surface, self.shared_surface, self.shared_context)
+
+    def release_current(self) -> None:
+        self.egl.eglMakeCurrent(self.display, self.egl.EGL_NO_SURFACE, self.egl.EGL_NO_SURFACE, self.egl.EGL_NO_CONTEXT)
+
+    def swap_buffers(self) -> None:
+        self.egl.eglSwapBuffers(self.display, self.surface)
+
+    def destroy(self) -> None:
+        egl = self.egl
+        self.release_current()
+        egl.eglDestroyContext(self.display, self.shared_context)
+        egl.eglDestroyContext(self.display, self.context)
+        egl.eglDestroySurface(self.display, self.shared_surface)
+        egl.eglDestroySurface(self.display, self.surface)
+        egl.eglTerminate(self.display)
+
+class OSMesaBackend(OffscreenBackend):
+    """
+    Software rendering into client memory with OSMesa, needs nothing but the Mesa library
+    """
+
+    platform = "osmesa"
+
+    def __init__(self, width=800, height=800, title="Untitled") -> None:
+        super().__init__(width, height, title)
+        from OpenGL import osmesa, arrays, GL
+        self.osmesa = osmesa
+        self.type = GL.GL_UNSIGNED_BYTE
+
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        self.shared_context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, self.context)
+        if not self.context or not self.shared_context:
+            raise Exception('[core/Window] Could not create the OSMesa contexts!')
+        self.buffer = arrays.GLubyteArray.zeros((height, width, 4))
+        self.shared_buffer = arrays.GLubyteArray.zeros((1, 1, 4))
+        self.make_current()
+        logger.info('[core/Window] Rendering offscreen with OSMesa')
+
+    def make_current(self) -> None:
+        self.osmesa.OSMesaMakeCurrent(self.context, self.buffer, self.type, self.width, self.height)
+
+    def make_shared_current(self) -> None:
+        self.osmesa.OSMesaMakeCurrent(self.shared_context, self.shared_buffer, self.type, 1, 1)
+
+    def release_current(self) -> None:
+        pass # A context stays current on its thread until another one is made current
+
+    def destroy(self) -> None:
+        self.osmesa.OSMesaDestroyContext(self.shared_context)
+        self.osmesa.OSMesaDestroyContext(self.context)
+
+BACKENDS = {
+    "glfw": GLFWBackend,
+    "null": NullBackend,
+    "egl": EGLBackend,
+    "osmesa": OSMesaBackend,
+}
@@ -0,0 +1,259 @@
+# Imports
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+from threading import Lock
+from collections import OrderedDict
+
+from core.logger import logger
+from core.mesh import DEFAULT_LAYOUT
+
+# Default constants
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "lost_horizons", "chunks")
+DEFAULT_CACHE_SIZE = 2 * 1024 * 1024 * 1024 # Bytes on disk before the least recently used chunks are deleted
+CHUNK_MAGIC = b"LHCHUNK\0"
+CHUNK_FORMAT = 1 # Bump when the file layout changes, older files are then treated as misses
+CHUNK_ALIGNMENT = 64 # Arrays start at multiples of this, so the memmaps are aligned
+CHUNK_SUFFIX = ".chunk"
+
+def chunk_key(quad, segments, seed, version) -> str:
+    """
+    Cache key of a generated chunk, from its quad corners, segment count, noise seed
+    and the version of the generator that made it. Bump the version when the terrain changes.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(quad, dtype=np.float64).tobytes())
+    digest.update(struct.pack("<qqq", int(segments), int(seed), int(version)))
+    return digest.hexdigest()
+
+def align(offset) -> int:
+    """
+    Round an offset up to the chunk alignment
+    """
+    return -(-offset // CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT
+
+class ChunkCache:
+    """
+    Persistent cache of finished chunk meshes, one file per chunk.
+    A file is the magic, a length-prefixed JSON header and the aligned vertex and index arrays,
+    which are mapped read-only straight into a Mesh when loading.
+    The directory is kept under a byte budget by deleting the least recently used files.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_SIZE, layout=DEFAULT_LAYOUT) -> None:
+        """
+        Open (or create) the cache directory and index the files already in it
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.layout = layout
+        self.descr = json.loads(json.dumps(layout.dtype.descr)) # As it reads back from a header
+        self.lock = Lock()
+        os.makedirs(path, exist_ok=True)
+
+        # Least recently used first, key -> file size
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        files = []
+        for entry in os.scandir(path):
+            if entry.is_file() and entry.name.endswith(CHUNK_SUFFIX):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(CHUNK_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        logger.info(f'[core/ChunkCache] {len(self.entries)} cached chunks, {self.total_bytes / 1024 / 1024:.1f} MB')
+
+    def file(self, key) -> str:
+        """
+        Path of the file of a chunk
+        """
+        return os.path.join(self.path, key + CHUNK_SUFFIX)
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def get(self, key) -> tuple | None:
+        """
+        Map a cached chunk, returns (data, indices, bounds) or None if it is not cached.
+        The arrays are read-only memmaps, indices is None for a triangle soup.
+        """
+        self.lock.acquire()
+        if key not in self.entries:
+            self.misses += 1
+            self.lock.release()
+            return None
+        self.entries.move_to_end(key)
+        self.lock.release()
+
+        path = self.file(key)
+        try:
+            with open(path, "rb") as file:
+                if file.read(len(CHUNK_MAGIC)) != CHUNK_MAGIC:
+                    raise ValueError("bad magic")
+                length, = struct.unpack("<I", file.read(4))
+                header = json.loads(file.read(length))
+            if header["format"] != CHUNK_FORMAT or header["dtype"] != self.descr:
+                raise ValueError("stale format")
+            data = self.map(path, self.layout.dtype, header["data_offset"], header["count"])
+            indices = None
+            if header["index_count"] is not None:
+                indices = self.map(path, np.uint32, header["index_offset"], header["index_count"])
+            low, high, center, radius = header["bounds"]
+            bounds = (
+                np.array(low, dtype=np.float32),
+                np.array(high, dtype=np.float32),
+                np.array(center, dtype=np.float32),
+                radius,
+            )
+            # Remember the use across restarts
+            os.utime(path)
+        except (OSError, ValueError, KeyError) as error:
+            logger.warning(f'[core/ChunkCache] Dropping unreadable chunk {key}: {error}')
+            self.remove(key)
+            self.lock.acquire()
+            self.misses += 1
+            self.lock.release()
+            return None
+
+        self.lock.acquire()
+        self.hits += 1
+        self.lock.release()
+        return data, indices, bounds
+
+    @staticmethod
+    def map(path, dtype, offset, count) -> np.ndarray:
+        """
+        Read-only memmap of an array in a chunk file, mmap can't map nothing so empty arrays are plain
+        """
+        if not count:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+    def load(self, key, mesh) -> bool:
+        """
+        Load a cached chunk into a mesh without copying, returns False on a miss
+        """
+        chunk = self.get(key)
+        if chunk is None:
+            return False
+        data, indices, bounds = chunk
+        mesh.adopt(data, indices, bounds)
+        return True
+
+    def put(self, key, mesh) -> None:
+        """
+        Store the current contents of a mesh.
+        The file is written next to its final place and renamed, so readers never see half a chunk.
+        """
+        mesh.lock.acquire()
+        data = np.ascontiguousarray(mesh.data)
+        indices = None if mesh.indices is None else np.ascontiguousarray(mesh.indices, dtype=np.uint32)
+        bounds = [
+            np.asarray(mesh.bounds_min).tolist(),
+            np.asarray(mesh.bounds_max).tolist(),
+            np.asarray(mesh.center).tolist(),
+            float(mesh.radius),
+        ]
+        mesh.lock.release()
+        if data.dtype != self.layout.dtype:
+            raise ValueError('[core/ChunkCache] Mesh does not match the cache vertex layout!')
+
+        # The offsets depend on the header length, so lay it out twice if they push it over an alignment boundary
+        header = {
+            "format": CHUNK_FORMAT,
+            "dtype": self.descr,
+            "count": len(data),
+            "index_count": None if indices is None else len(indices),
+            "bounds": bounds,
+            "data_offset": 0,
+            "index_offset": 0,
+        }
+        while True:
+            encoded = json.dumps(header).encode()
+            data_offset = align(len(CHUNK_MAGIC) + 4 + len(encoded))
+            index_offset = align(data_offset + data.nbytes)
+            if (header["data_offset"], header["index_offset"]) == (data_offset, index_offset):
+                break
+            header["data_offset"], header["index_offset"] = data_offset, index_offset
+
+        path = self.file(key)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(CHUNK_MAGIC)
+            file.write(struct.pack("<I", len(encoded)))
+            file.write(encoded)
+            file.seek(data_offset)
+            file.write(data.tobytes())
+            if indices is not None:
+                file.seek(index_offset)
+                file.write(indices.tobytes())
+            size = file.tell()
+        os.replace(temporary, path)
+
+        self.lock.acquire()
+        self.total_bytes += size - self.entries.pop(key, 0)
+        self.entries[key] = size
+        self.lock.release()
+        self.evict()
+
+    def remove(self, key) -> None:
+        """
+        Delete a chunk from the cache.
+        Meshes still mapping it keep working, the data goes away with the last mapping.
+        """
+        self.lock.acquire()
+        self.total_bytes -= self.entries.pop(key, 0)
+        self.lock.release()
+        try:
+            os.remove(self.file(key))
+        except OSError:
+            pass # Already gone, or still mapped on a platform that does not allow it
+
+    def evict(self) -> None:
+        """
+        Delete the least recently used chunks until the cache fits in its budget
+        """
+        victims = []
+        self.lock.acquire()
+        while self.entries and self.total_bytes > self.max_bytes:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            victims.append(key)
+        self.evictions += len(victims)
+        self.lock.release()
+
+        for key in victims:
+            try:
+                os.remove(self.file(key))
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        """
+        Delete every cached chunk
+        """
+        for key in list(self.entries):
+            self.remove(key)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Snapshot of the cache size and hit counters
+        """
+        return {
+            "chunks": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
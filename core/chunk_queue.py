@@ -0,0 +1,229 @@
+# Imports
+import math
+import numpy as np
+from threading import Lock
+from concurrent.futures import CancelledError
+
+from core.logger import logger
+from core.mesh import DEFAULT_LAYOUT
+from core.noise import displace, shade
+from core.tesselator import DEFAULT_SEGMENTS, tesselate
+
+# Default constants
+SUBMIT_LIMIT = 8 # Chunk jobs submitted per frame
+INTEGRATE_LIMIT = 4 # Finished chunks handed over per frame
+FIELD_OF_VIEW = 70 # Vertical, in degrees
+VIEWPORT_HEIGHT = 800 # In pixels
+NEAR_DISTANCE = 1.0 # Distances are clamped to this, so chunks around the camera don't divide by zero
+REPRIORITIZE_CHANGE = 0.1 # Relative priority change before a queued job is moved in the job system
+
+def build_chunk(quad, segments, radius, center, layout, out) -> None:
+    """
+    Job generating the vertices of a terrain chunk into its shared `data` output:
+    tesselate the cube quad, push it onto the planet and color it.
+    The quad is in world space, like `center`, not relative to the planet.
+    """
+    positions, heights = displace(tesselate(quad, segments), center, radius)
+    layout.fill(out["data"], positions, shade(positions, heights))
+
+def screen_space_errors(centers, radii, errors, camera, scale) -> np.ndarray:
+    """
+    How many pixels the geometric `errors` of bounding spheres span on screen, the standard
+    error / distance * viewport_height / (2 tan(fov / 2)) with the distance to the sphere surface
+    """
+    offsets = centers - np.asarray(camera, dtype=np.float64)
+    distances = np.sqrt(np.einsum("ij,ij->i", offsets, offsets)) - radii
+    return errors * scale / np.maximum(distances, NEAR_DISTANCE)
+
+class ChunkQueue:
+    """
+    Generates the chunks of a QuadTree on a JobSystem, the most visible detail first.
+    Requests are ordered by their screen-space error, so the chunk under the camera beats a
+    distant one of the same size, and chunks outside the frustum or behind the planet wait for
+    every visible one. Priorities are recomputed for all waiting and queued requests each frame
+    in one vectorized pass, and only a few jobs are submitted and a few results handed over
+    per frame, so neither the workers nor the upload path get flooded.
+    """
+
+    def __init__(self, tree, jobs, on_chunk, segments=DEFAULT_SEGMENTS, layout=DEFAULT_LAYOUT,
+                 submit_limit=SUBMIT_LIMIT, integrate_limit=INTEGRATE_LIMIT,
+                 fov=FIELD_OF_VIEW, viewport_height=VIEWPORT_HEIGHT) -> None:
+        """
+        `on_chunk(handle, result)` receives every finished chunk on the thread calling update(),
+        `result["data"]` holds the vertices in `layout`, to be drawn with grid_indices(segments)
+        """
+        self.tree = tree
+        self.jobs = jobs
+        self.on_chunk = on_chunk
+        self.segments = segments
+        self.layout = layout
+        self.submit_limit = submit_limit
+        self.integrate_limit = integrate_limit
+        self.resize(viewport_height, fov)
+
+        self.waiting = {} # Requested but not submitted yet, handle -> None, in request order
+        self.in_flight = {} # Submitted, handle -> Job
+        self.priorities = {} # Of the waiting and submitted handles as of the last update()
+        self.lock = Lock()
+        self.finished = [] # (handle, job) pairs from the executor thread, guarded by the lock
+
+        # Statistics
+        self.submitted = 0
+        self.integrated = 0
+        self.discarded = 0
+        self.failed = 0
+
+    def resize(self, viewport_height, fov=None) -> None:
+        """
+        Update the projection after the window or the field of view changed
+        """
+        self.fov = self.fov if fov is None else fov
+        self.scale = viewport_height / (2 * math.tan(math.radians(self.fov) / 2))
+
+    def request(self, handles) -> None:
+        """
+        Ask for the chunks of some nodes, e.g. the ones QuadTree.update() created
+        """
+        for handle in np.asarray(handles).tolist():
+            if handle not in self.in_flight:
+                self.waiting[handle] = None
+
+    def discard(self, handles) -> None:
+        """
+        Forget requests which are not needed anymore, e.g. the nodes QuadTree.update() removed.
+        Their jobs are cancelled, and results which already finished are dropped.
+        """
+        for handle in np.asarray(handles).tolist():
+            self.priorities.pop(handle, None)
+            if handle in self.waiting:
+                del self.waiting[handle]
+                self.discarded += 1
+            job = self.in_flight.pop(handle, None)
+            if job is not None:
+                job.cancel()
+                self.discarded += 1
+
+    def track(self, created, removed) -> None:
+        """
+        Follow the changes of QuadTree.update(). Removed handles go first, as the tree
+        may hand a freed handle straight to a new node.
+        """
+        self.discard(removed)
+        self.request(created)
+
+    def prioritize(self, handles, camera, frustum=None) -> np.ndarray:
+        """
+        Priorities of nodes, higher first. Visible nodes get their screen-space error in pixels,
+        invisible ones -1 / (1 + error), which still orders them but always below the visible ones.
+        """
+        tree = self.tree
+        centers = tree.centers[handles]
+        radii = tree.radii[handles]
+        errors = radii * 2 / self.segments # About the size of one grid cell
+        priorities = screen_space_errors(centers, radii, errors, camera, self.scale)
+
+        # Facing away from the camera behind the planet, or outside the view
+        normals = centers - tree.center
+        normals /= np.linalg.norm(normals, axis=1)[:, None]
+        visible = np.einsum("ij,ij->i", normals, np.asarray(camera, dtype=np.float64) - centers) > -radii
+        if frustum is not None:
+            visible &= frustum.test_spheres(centers, radii)
+        return np.where(visible, priorities, -1 / (1 + priorities))
+
+    def update(self, camera, frustum=None) -> dict:
+        """
+        Call once per frame: reprioritize everything for the camera, submit the most important
+        waiting requests and hand over the most important finished chunks.
+        Returns how many were submitted and integrated.
+        """
+        # Reprioritize the waiting and the submitted requests in one pass
+        handles = np.fromiter(list(self.waiting) + list(self.in_flight), dtype=np.intp)
+        priorities = self.prioritize(handles, camera, frustum) if len(handles) else np.zeros(0)
+        self.priorities = dict(zip(handles.tolist(), priorities.tolist()))
+        for handle, job in self.in_flight.items():
+            priority = self.priorities[handle]
+            if abs(priority - job.priority) > REPRIORITIZE_CHANGE * abs(job.priority):
+                job.reprioritize(priority)
+
+        # Submit the most important waiting requests, until the job system is full
+        waiting = handles[:len(self.waiting)]
+        if len(waiting) > self.submit_limit:
+            order = np.argpartition(-priorities[:len(waiting)], self.submit_limit)[:self.submit_limit]
+            waiting = waiting[order]
+        tree = self.tree
+        submitted = 0
+        for handle in sorted(waiting.tolist(), key=self.priorities.get, reverse=True):
+            job = self.jobs.submit(
+                build_chunk, tree.quads[handle] + tree.center, self.segments, tree.radius, tree.center, self.layout,
+                outputs={"data": ((self.segments + 1) ** 2, self.layout.dtype)},
+                priority=self.priorities[handle], tag=handle, block=False,
+            )
+            if job is None:
+                break
+            del self.waiting[handle]
+            self.in_flight[handle] = job
+            job.add_done_callback(lambda job, handle=handle: self.finish(handle, job))
+            submitted += 1
+        self.submitted += submitted
+        return {"submitted": submitted, "integrated": self.integrate()}
+
+    def finish(self, handle, job) -> None:
+        """
+        Collect a finished job, runs in the thread of the executor
+        """
+        self.lock.acquire()
+        self.finished.append((handle, job))
+        self.lock.release()
+
+    def integrate(self) -> int:
+        """
+        Hand the most important finished chunks to on_chunk(), at most integrate_limit of them.
+        Results of discarded requests are dropped, failed chunks are requested again.
+        """
+        self.lock.acquire()
+        finished, self.finished = self.finished, []
+        self.lock.release()
+
+        # Drop what nobody wants anymore, the handle may even belong to a new node by now
+        current = []
+        for handle, job in finished:
+            if self.in_flight.get(handle) is not job:
+                if not job.cancelled() and job.exception() is None:
+                    job.result().release()
+                continue
+            if job.cancelled() or isinstance(job.exception(), CancelledError):
+                del self.in_flight[handle]
+                continue
+            if job.exception() is not None:
+                logger.error(f'[core/ChunkQueue] Chunk {handle} failed: {job.exception()!r}')
+                del self.in_flight[handle]
+                self.waiting[handle] = None
+                self.failed += 1
+                continue
+            current.append((handle, job))
+
+        # Highest priority first, the rest waits for the next frames
+        current.sort(key=lambda entry: self.priorities.get(entry[0], entry[1].priority), reverse=True)
+        self.lock.acquire()
+        self.finished = current[self.integrate_limit:] + self.finished
+        self.lock.release()
+        for handle, job in current[:self.integrate_limit]:
+            del self.in_flight[handle]
+            self.on_chunk(handle, job.result())
+        self.integrated += min(len(current), self.integrate_limit)
+        return min(len(current), self.integrate_limit)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Snapshot of the request counters
+        """
+        return {
+            "waiting": len(self.waiting),
+            "in_flight": len(self.in_flight),
+            "finished": len(self.finished),
+            "submitted": self.submitted,
+            "integrated": self.integrated,
+            "discarded": self.discarded,
+            "failed": self.failed,
+        }
@@ -0,0 +1,81 @@
+# Imports
+import numpy as np
+from OpenGL.GL import (
+    glGetFloatv,
+
+    GL_PROJECTION_MATRIX,
+    GL_MODELVIEW_MATRIX,
+)
+
+def compute_bounds(positions) -> tuple:
+    """
+    Bounding box and bounding sphere of a (n, 3) position array.
+    Returns (min, max, center, radius), an empty array gets a zero sized volume at the origin.
+    """
+    if not len(positions):
+        zero = np.zeros(3, dtype=np.float32)
+        return zero, zero, zero, 0.0
+    low = positions.min(axis=0)
+    high = positions.max(axis=0)
+    center = (low + high) * 0.5
+    radius = float(np.sqrt(((positions - center) ** 2).sum(axis=1).max()))
+    return low, high, center, radius
+
+class Frustum:
+    """
+    The six clipping planes of a view frustum, for testing many bounding volumes at once.
+    Each plane is (a, b, c, d) with the normal pointing inside, normalized.
+    """
+
+    def __init__(self, matrix) -> None:
+        """
+        Extract the planes from a 4x4 view-projection matrix (row-major, column vectors)
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        planes = np.array([
+            matrix[3] + matrix[0], # Left
+            matrix[3] - matrix[0], # Right
+            matrix[3] + matrix[1], # Bottom
+            matrix[3] - matrix[1], # Top
+            matrix[3] + matrix[2], # Near
+            matrix[3] - matrix[2], # Far
+        ])
+        planes /= np.linalg.norm(planes[:, :3], axis=1)[:, None]
+        self.planes = planes.astype(np.float32)
+        self.normals = self.planes[:, :3]
+        self.distances = self.planes[:, 3]
+
+    @classmethod
+    def from_gl(cls) -> "Frustum":
+        """
+        Build the frustum from the current fixed-function projection and modelview matrices
+        """
+        # GL hands the matrices out column-major, so they come out transposed
+        projection = np.asarray(glGetFloatv(GL_PROJECTION_MATRIX)).reshape(4, 4).T
+        modelview = np.asarray(glGetFloatv(GL_MODELVIEW_MATRIX)).reshape(4, 4).T
+        return cls(projection @ modelview)
+
+    def test_spheres(self, centers, radii) -> np.ndarray:
+        """
+        Boolean mask of the spheres which are at least partially inside the frustum
+        """
+        distances = centers @ self.normals.T + self.distances
+        return (distances >= -radii[:, None]).all(axis=1)
+
+    def test_boxes(self, mins, maxs) -> np.ndarray:
+        """
+        Boolean mask of the axis-aligned boxes which are at least partially inside the frustum.
+        Each plane is tested against the box corner furthest along its normal.
+        """
+        corners = np.where(self.normals > 0, maxs[:, None, :], mins[:, None, :])
+        distances = (corners * self.normals).sum(axis=2) + self.distances
+        return (distances >= 0).all(axis=1)
+
+    def test(self, centers, radii, mins, maxs) -> np.ndarray:
+        """
+        Boolean mask of the visible volumes, spheres first and boxes for the survivors
+        """
+        visible = self.test_spheres(centers, radii)
+        candidates = np.flatnonzero(visible)
+        visible[candidates] = self.test_boxes(mins[candidates], maxs[candidates])
+        return visible
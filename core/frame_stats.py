@@ -0,0 +1,148 @@
+# Imports
+import time
+import numpy as np
+
+# Default constants
+FRAME_HISTORY = 512 # Frame times kept for the statistics
+PERCENTILE_REFRESH = 32 # Frames between two percentile computations
+HITCH_FACTOR = 2.0 # A frame taking this many times the median is a hitch
+
+class FrameStats:
+    """
+    Frame time statistics over a fixed-size ring buffer of the last frames.
+    Everything costs O(1) per frame: the mean comes from a running sum, hitches from a
+    running count, and the percentiles are only recomputed every few frames.
+    """
+
+    def __init__(self, capacity=FRAME_HISTORY, hitch_factor=HITCH_FACTOR, refresh=PERCENTILE_REFRESH) -> None:
+        """
+        Allocate the ring buffers
+        """
+        self.capacity = capacity
+        self.hitch_factor = hitch_factor
+        self.refresh = refresh
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.hitch_flags = np.zeros(capacity, dtype=bool)
+        self.head = 0 # Next slot to write
+        self.count = 0 # Frames in the buffer
+        self.frames = 0 # Frames ever recorded
+
+        # Running values
+        self.sum = 0.0
+        self.hitches = 0 # In the buffer
+        self.total_hitches = 0
+        self.last_time = None
+        self.percentiles = (0.0, 0.0, 0.0) # p50, p95, p99
+        self.stale = 0 # Frames since the percentiles were computed
+
+    def tick(self, now=None) -> float:
+        """
+        Record the time since the last tick as a frame, call it once per frame.
+        Returns the frame time, 0 for the first tick.
+        """
+        now = time.perf_counter() if now is None else now
+        last, self.last_time = self.last_time, now
+        if last is None:
+            return 0.0
+        self.add(now - last)
+        return now - last
+
+    def skip(self, seconds) -> None:
+        """
+        Leave time out of the current frame, e.g. while the window idles waiting for events
+        """
+        if self.last_time is not None:
+            self.last_time += seconds
+
+    def add(self, frame_time) -> None:
+        """
+        Record a frame time in seconds
+        """
+        head = self.head
+        if self.count == self.capacity:
+            self.sum -= float(self.times[head])
+            self.hitches -= bool(self.hitch_flags[head])
+        else:
+            self.count += 1
+
+        # Judge the frame against the last known median, before any frame is seen everything is fine
+        hitch = self.percentiles[0] > 0 and frame_time > self.percentiles[0] * self.hitch_factor
+        self.times[head] = frame_time
+        self.hitch_flags[head] = hitch
+        self.sum += frame_time
+        self.hitches += hitch
+        self.total_hitches += hitch
+        self.head = (head + 1) % self.capacity
+        self.frames += 1
+
+        self.stale += 1
+        if self.stale >= self.refresh or self.count < self.refresh:
+            self.update_percentiles()
+
+    def update_percentiles(self) -> None:
+        """
+        Recompute the cached percentiles from the buffer
+        """
+        self.stale = 0
+        self.percentiles = tuple(np.percentile(self.times[:self.count], (50, 95, 99)).tolist())
+
+    def reset(self) -> None:
+        """
+        Forget every frame, e.g. after a loading screen
+        """
+        self.__init__(self.capacity, self.hitch_factor, self.refresh)
+
+    @property
+    def mean(self) -> float:
+        """
+        Mean frame time in seconds
+        """
+        return self.sum / self.count if self.count else 0.0
+
+    @property
+    def fps(self) -> float:
+        """
+        Frames per second over the buffer
+        """
+        return self.count / self.sum if self.sum > 0 else 0.0
+
+    @property
+    def last(self) -> float:
+        """
+        Time of the last frame in seconds
+        """
+        return float(self.times[self.head - 1]) if self.count else 0.0
+
+    @property
+    def p50(self) -> float: return self.percentiles[0]
+
+    @property
+    def p95(self) -> float: return self.percentiles[1]
+
+    @property
+    def p99(self) -> float: return self.percentiles[2]
+
+    @property
+    def stats(self) -> dict:
+        """
+        Snapshot of the statistics, frame times in milliseconds
+        """
+        return {
+            "frames": self.frames,
+            "fps": self.fps,
+            "last": self.last * 1000,
+            "mean": self.mean * 1000,
+            "p50": self.p50 * 1000,
+            "p95": self.p95 * 1000,
+            "p99": self.p99 * 1000,
+            "hitches": self.hitches,
+            "total_hitches": self.total_hitches,
+        }
+
+    def history(self) -> np.ndarray:
+        """
+        The buffered frame times in seconds, oldest first
+        """
+        if self.count < self.capacity:
+            return self.times[:self.count].copy()
+        return np.roll(self.times, -self.head)
@@ -0,0 +1,197 @@
+# Imports
+import time
+import numpy as np
+from OpenGL.GL import (
+    glEnableClientState,
+    glDisableClientState,
+    glVertexPointer,
+    glColorPointer,
+    glDrawArrays,
+    glEnable,
+    glDisable,
+    glIsEnabled,
+    glBlendFunc,
+    glMatrixMode,
+    glPushMatrix,
+    glPopMatrix,
+    glLoadIdentity,
+    glOrtho,
+
+    GL_VERTEX_ARRAY,
+    GL_COLOR_ARRAY,
+    GL_FLOAT,
+    GL_UNSIGNED_BYTE,
+    GL_TRIANGLES,
+    GL_BLEND,
+    GL_DEPTH_TEST,
+    GL_SRC_ALPHA,
+    GL_ONE_MINUS_SRC_ALPHA,
+    GL_PROJECTION,
+    GL_MODELVIEW,
+)
+
+# Default constants
+HUD_REFRESH = 0.25 # Seconds between two rebuilds of the overlay
+HUD_SCALE = 2 # Screen pixels per font pixel
+HUD_GRAPH_FRAMES = 128 # Frames shown in the frame time graph
+HUD_GRAPH_HEIGHT = 40 # In font pixels, the top of the graph is 33 ms (30 FPS)
+HUD_GRAPH_RANGE = 1 / 30
+
+# 3x5 pixel font, one string of rows per glyph, lower case is drawn as upper case
+FONT = {
+    "0": "111101101101111", "1": "010110010010111", "2": "111001111100111", "3": "111001111001111",
+    "4": "101101111001001", "5": "111100111001111", "6": "111100111101111", "7": "111001001001001",
+    "8": "111101111101111", "9": "111101111001111", "A": "010101111101101", "B": "110101110101110",
+    "C": "011100100100011", "D": "110101101101110", "E": "111100110100111", "F": "111100110100100",
+    "G": "011100101101011", "H": "101101111101101", "I": "111010010010111", "J": "001001001101010",
+    "K": "101101110101101", "L": "100100100100111", "M": "101111111101101", "N": "110101101101101",
+    "O": "010101101101010", "P": "110101110100100", "Q": "010101101110011", "R": "110101110101101",
+    "S": "011100010001110", "T": "111010010010010", "U": "101101101101111", "V": "101101101101010",
+    "W": "101101111111101", "X": "101101010101101", "Y": "101101010010010", "Z": "111001010100111",
+    " ": "000000000000000", ".": "000000000000010", ":": "000010000010000", "/": "001001010100100",
+    "%": "101001010100101", "-": "000000111000000", "(": "010100100100010", ")": "010001001001010",
+    "?": "111001010000010",
+}
+GLYPH_CODES = {char: code for code, char in enumerate(FONT)}
+GLYPHS = np.array([[bit == "1" for bit in rows] for rows in FONT.values()], dtype=bool).reshape(-1, 5, 3)
+
+# Colors
+TEXT_COLOR = (255, 255, 255, 255)
+PANEL_COLOR = (0, 0, 0, 160)
+GRAPH_COLOR = (80, 200, 120, 255)
+HITCH_COLOR = (230, 70, 60, 255)
+
+def quads(x, y, width, height, color) -> tuple:
+    """
+    Two triangles per rectangle, from arrays of corners and sizes.
+    Returns the (n * 6, 2) positions and (n * 6, 4) colors.
+    """
+    x, y, width, height = np.broadcast_arrays(*(np.asarray(value, dtype=np.float32) for value in (x, y, width, height)))
+    corners = np.array([(0, 0), (1, 0), (1, 1), (0, 0), (1, 1), (0, 1)], dtype=np.float32)
+    positions = np.empty((len(x), 6, 2), dtype=np.float32)
+    positions[..., 0] = x[:, None] + corners[:, 0] * width[:, None]
+    positions[..., 1] = y[:, None] + corners[:, 1] * height[:, None]
+    colors = np.empty((len(x), 6, 4), dtype=np.uint8)
+    colors[:] = np.asarray(color, dtype=np.uint8).reshape(-1, 1, 4)
+    return positions.reshape(-1, 2), colors.reshape(-1, 4)
+
+class HUD:
+    """
+    Performance overlay showing a FrameStats.
+    Text and graph are plain colored quads in one vertex array, so the whole HUD
+    is a single draw call, and the geometry is only rebuilt a few times per second.
+    """
+
+    def __init__(self, stats, position=(8, 8), scale=HUD_SCALE, refresh=HUD_REFRESH, graph=True) -> None:
+        """
+        Initialize the overlay, `position` is the top left corner in window pixels
+        """
+        self.stats = stats
+        self.position = position
+        self.scale = scale
+        self.refresh = refresh
+        self.graph = graph
+        self.extra = {} # Additional "LABEL": value lines, e.g. from the renderer
+        self.positions = np.zeros((0, 2), dtype=np.float32)
+        self.colors = np.zeros((0, 4), dtype=np.uint8)
+        self.built = None # When the geometry was last built
+
+    def lines(self) -> list:
+        """
+        The text lines of the overlay
+        """
+        stats = self.stats.stats
+        lines = [
+            f"FPS {stats['fps']:.1f}",
+            f"FRAME {stats['mean']:.2f} MS",
+            f"P50 {stats['p50']:.2f} P95 {stats['p95']:.2f} P99 {stats['p99']:.2f}",
+            f"HITCHES {stats['hitches']} ({stats['total_hitches']})",
+        ]
+        lines += [f"{label} {value}" for label, value in self.extra.items()]
+        return lines
+
+    def text(self, lines, x, y) -> tuple:
+        """
+        Quads of the lit font pixels of some lines of text
+        """
+        codes, rows, columns = [], [], []
+        for row, line in enumerate(lines):
+            for column, char in enumerate(line.upper()):
+                codes.append(GLYPH_CODES.get(char, GLYPH_CODES["?"]))
+                rows.append(row)
+                columns.append(column)
+        chars, pixel_rows, pixel_columns = np.nonzero(GLYPHS[np.array(codes, dtype=np.intp)])
+        scale = self.scale
+        left = x + (np.array(columns)[chars] * 4 + pixel_columns) * scale
+        top = y + (np.array(rows)[chars] * 7 + pixel_rows) * scale
+        return quads(left, top, scale, scale, TEXT_COLOR)
+
+    def build(self) -> None:
+        """
+        Rebuild the vertex arrays from the current statistics
+        """
+        x, y = self.position
+        scale = self.scale
+        padding = 2 * scale
+        lines = self.lines()
+        width = max(len(line) for line in lines) * 4 * scale
+        height = len(lines) * 7 * scale
+        parts = []
+
+        # Frame time graph under the text, one bar per frame
+        if self.graph:
+            history = self.stats.history()[-HUD_GRAPH_FRAMES:]
+            graph_top = y + height + padding
+            graph_height = HUD_GRAPH_HEIGHT * scale
+            width = max(width, HUD_GRAPH_FRAMES * scale)
+            bars = np.minimum(history / HUD_GRAPH_RANGE, 1) * graph_height
+            hitch = history > self.stats.p50 * self.stats.hitch_factor
+            colors = np.where(hitch[:, None], HITCH_COLOR, GRAPH_COLOR)
+            parts.append(quads(
+                x + np.arange(len(history)) * scale, graph_top + graph_height - bars,
+                scale, bars, colors
+            ))
+            height += padding + graph_height
+
+        parts.insert(0, quads([x - padding], [y - padding], width + 2 * padding, height + 2 * padding, PANEL_COLOR))
+        parts.append(self.text(lines, x, y))
+        self.positions = np.ascontiguousarray(np.concatenate([part[0] for part in parts]))
+        self.colors = np.ascontiguousarray(np.concatenate([part[1] for part in parts]))
+        self.built = time.perf_counter()
+
+    def draw(self, width, height) -> None:
+        """
+        Draw the overlay over a framebuffer of the given size
+        """
+        if self.built is None or time.perf_counter() - self.built >= self.refresh:
+            self.build()
+
+        # Pixel coordinates with the origin at the top left
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glOrtho(0, width, height, 0, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+        depth = glIsEnabled(GL_DEPTH_TEST)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(2, GL_FLOAT, 0, self.positions)
+        glColorPointer(4, GL_UNSIGNED_BYTE, 0, self.colors)
+        glDrawArrays(GL_TRIANGLES, 0, len(self.positions))
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+
+        # Restore the state
+        glDisable(GL_BLEND)
+        if depth:
+            glEnable(GL_DEPTH_TEST)
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopMatrix()
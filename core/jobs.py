@@ -0,0 +1,529 @@
+# Imports
+import os
+import heapq
+import weakref
+import itertools
+import numpy as np
+import multiprocessing
+from collections import OrderedDict
+from threading import Lock, BoundedSemaphore
+from concurrent.futures import Future, ProcessPoolExecutor, CancelledError, wait as wait_futures
+from multiprocessing import shared_memory
+
+from core.logger import logger
+
+# Default constants
+MAX_PENDING = 64 # Jobs in flight before submit() blocks
+SHARED_POOL_CAP = 256 * 1024 * 1024 # Bytes of unused shared memory kept for reuse
+MIN_SEGMENT_SIZE = 64 * 1024 # Smallest pooled segment, in bytes
+START_METHOD = "spawn" # Forking a process with a GL context and running threads is asking for trouble
+WORKER_SEGMENT_CACHE = 32 # Segments a worker keeps mapped between jobs
+DISPATCH_DEPTH = 2 # Jobs handed to the executor per worker, the rest waits in the priority queue
+
+# Segments opened by this worker process, least recently used first, name -> SharedMemory
+WORKER_SEGMENTS = OrderedDict()
+
+# Cancellation flag of the job running in this worker process, (flags array, slot)
+CURRENT_JOB = None
+
+def cancelled() -> bool:
+    """
+    Call from inside a job: whether it was cancelled and should stop early.
+    Long jobs should check this every now and then, its result is thrown away anyway.
+    """
+    return CURRENT_JOB is not None and bool(CURRENT_JOB[0][CURRENT_JOB[1]])
+
+def map_segment(segment) -> shared_memory.SharedMemory:
+    """
+    Map a segment in a worker process, reusing the mapping of earlier jobs
+    """
+    memory = WORKER_SEGMENTS.get(segment)
+    if memory is None:
+        memory = WORKER_SEGMENTS[segment] = shared_memory.SharedMemory(segment)
+    WORKER_SEGMENTS.move_to_end(segment)
+    return memory
+
+def run_job(function, args, kwargs, outputs, flags=None, slot=0) -> object:
+    """
+    Runs in a worker process: map the output segments and call the job with them as `out`
+    """
+    global CURRENT_JOB
+    CURRENT_JOB = None
+    if flags is not None:
+        CURRENT_JOB = (np.ndarray(slot + 1, dtype=np.uint8, buffer=map_segment(flags).buf), slot)
+        if cancelled():
+            return None
+    if outputs:
+        out = {}
+        for name, (segment, shape, dtype) in outputs.items():
+            out[name] = np.ndarray(shape, dtype=dtype, buffer=map_segment(segment).buf)
+        kwargs = dict(kwargs, out=out)
+        
+        # Unmap segments the parent may have unlinked meanwhile, except the ones in use
+        while len(WORKER_SEGMENTS) > max(WORKER_SEGMENT_CACHE, len(outputs) + 1):
+            WORKER_SEGMENTS.popitem(last=False)[1].close()
+    return function(*args, **kwargs)
+
+class SharedMemoryPool:
+    """
+    Recycles shared memory segments in power of two size classes.
+    Segments are unlinked only when the pool is over its cap or closed.
+    """
+
+    def __init__(self, cap=SHARED_POOL_CAP) -> None:
+        """
+        Initialize the free lists and counters
+        """
+        self.cap = cap
+        self.lock = Lock()
+        self.free = {} # size class -> list of unused segments
+        self.lent = {} # name -> segment
+        self.cached_bytes = 0
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def size_class(size) -> int:
+        """
+        Smallest pooled segment size holding `size` bytes
+        """
+        return max(MIN_SEGMENT_SIZE, 1 << (max(size, 1) - 1).bit_length())
+
+    def acquire(self, size) -> shared_memory.SharedMemory:
+        """
+        A segment of at least `size` bytes
+        """
+        size = self.size_class(size)
+        self.lock.acquire()
+        free = self.free.get(size)
+        if free:
+            segment = free.pop()
+            self.cached_bytes -= size
+            self.hits += 1
+        else:
+            segment = None
+            self.misses += 1
+        self.lock.release()
+
+        if segment is None:
+            segment = shared_memory.SharedMemory(create=True, size=size)
+        self.lock.acquire()
+        self.lent[segment.name] = segment
+        self.used_bytes += size
+        self.lock.release()
+        return segment
+
+    def release(self, segment) -> None:
+        """
+        Take a segment back, unlinking it if the pool is full
+        """
+        size = self.size_class(segment.size)
+        self.lock.acquire()
+        if self.lent.pop(segment.name, None) is None:
+            self.lock.release()
+            return
+        self.used_bytes -= size
+        keep = self.cached_bytes + size <= self.cap
+        if keep:
+            self.free.setdefault(size, []).append(segment)
+            self.cached_bytes += size
+        self.lock.release()
+        if not keep:
+            self.destroy(segment)
+
+    @staticmethod
+    def destroy(segment) -> None:
+        """
+        Unmap and unlink a segment, arrays still using it make the unmap wait for them
+        """
+        try:
+            segment.close()
+        except BufferError:
+            pass # Still viewed, the mapping goes away with the last view
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        """
+        Unlink every segment, lent ones included
+        """
+        self.lock.acquire()
+        segments = [segment for free in self.free.values() for segment in free] + list(self.lent.values())
+        self.free = {}
+        self.lent = {}
+        self.cached_bytes = 0
+        self.used_bytes = 0
+        self.lock.release()
+        for segment in segments:
+            self.destroy(segment)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Snapshot of the pool counters
+        """
+        return {
+            "used_bytes": self.used_bytes,
+            "cached_bytes": self.cached_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+class JobResult:
+    """
+    What a job future resolves to: the return value of the job and its output arrays.
+    The arrays are views of pooled shared memory, nothing was copied. A segment goes back
+    to the pool once its array and every view of it are gone, e.g. when a Mesh using it
+    is disposed, or right away with release() if the arrays were only read.
+    """
+
+    def __init__(self, value, arrays, segments, pool) -> None:
+        self.value = value
+        self.arrays = arrays
+        self.finalizers = [
+            weakref.finalize(arrays[name], pool.release, segments[name])
+            for name in arrays
+        ]
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self.arrays[name]
+
+    def release(self) -> None:
+        """
+        Give the segments back now, the arrays must not be used afterwards
+        """
+        self.arrays = {}
+        for finalizer in self.finalizers:
+            finalizer()
+
+class Job(Future):
+    """
+    Handle of a submitted job, a future of its JobResult.
+    Queued jobs can be reprioritized and cancelled outright, running ones are asked to stop
+    through cancelled(). A job whose group moved on to a newer epoch is stale, its result
+    is dropped without mapping it and the future raises CancelledError.
+    """
+
+    def __init__(self, system, function, args, kwargs, outputs, priority, group, tag) -> None:
+        super().__init__()
+        self.system = system
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.outputs = outputs
+        self.priority = priority
+        self.group = group
+        self.tag = tag # Anything identifying the work for the caller, e.g. a chunk key
+        self.epoch = system.epochs.get(group, 0)
+        self.version = 0 # Bumped on reprioritization, older heap entries are skipped
+        self.slot = None # Cancellation flag while running
+        self.cancel_requested = False
+
+    @property
+    def stale(self) -> bool:
+        """
+        Whether the group of the job moved on to a newer epoch since it was submitted
+        """
+        return self.epoch != self.system.epochs.get(self.group, 0)
+
+    def cancel(self) -> bool:
+        """
+        Cancel the job, returns False if it already finished
+        """
+        return self.system.cancel(self)
+
+    def reprioritize(self, priority) -> None:
+        """
+        Change the priority of the job while it is still queued
+        """
+        self.system.reprioritize(self, priority)
+
+class JobSystem:
+    """
+    Runs picklable work on a persistent process pool and hands out futures.
+    Jobs may ask for output arrays, which are allocated in pooled shared memory, filled by the
+    worker in place and mapped by the caller without a copy. At most `max_pending` jobs are
+    in flight, submit() blocks beyond that so producers can't run away from the workers.
+    Jobs wait in a priority queue and only a few per worker are handed to the executor,
+    so they can still be reprioritized or cancelled cheaply until they start.
+    """
+
+    def __init__(self, workers=None, max_pending=MAX_PENDING, pool_cap=SHARED_POOL_CAP, start_method=START_METHOD) -> None:
+        """
+        Start the worker processes
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(start_method))
+        self.memory = SharedMemoryPool(pool_cap)
+        self.slots = BoundedSemaphore(max_pending)
+        self.max_pending = max_pending
+        self.lock = Lock()
+        self.closed = False
+
+        # Queued jobs, entries are (-priority, order, version, job)
+        self.queue = []
+        self.order = itertools.count()
+        self.queued = 0
+        self.running = set()
+        self.epochs = {} # group -> current epoch
+
+        # Cancellation flags, one byte per dispatch slot
+        self.depth = self.workers * DISPATCH_DEPTH
+        self.flags_segment = shared_memory.SharedMemory(create=True, size=self.depth)
+        self.flags = np.ndarray(self.depth, dtype=np.uint8, buffer=self.flags_segment.buf)
+        self.flags[:] = 0
+        self.free_flags = list(range(self.depth))
+
+        # Statistics
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0 # Cancelled or stale
+
+        logger.info(f'[core/JobSystem] Started {self.workers} worker processes')
+
+    def __enter__(self) -> "JobSystem":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+
+    @property
+    def pending(self) -> int:
+        return self.queued + len(self.running)
+
+    def submit(self, function, *args, outputs=None, priority=0, group=None, tag=None, block=True, timeout=None, **kwargs) -> Job | None:
+        """
+        Submit `function(*args, **kwargs)` to the pool and return its Job, a future of its JobResult.
+        `function` must be importable by the workers, i.e. defined at module level.
+        `outputs` maps names to (shape, dtype) of arrays the job fills, it gets them as `out`.
+        Higher `priority` jobs start first. `group` ties the job to an epoch, see advance().
+        Blocks while max_pending jobs are in flight, with block=False (or after `timeout`)
+        it returns None instead, so callers can try again next frame.
+        """
+        if self.closed:
+            raise RuntimeError('[core/JobSystem] Submitting to a job system which was shut down!')
+        if not self.slots.acquire(block, timeout):
+            return None
+
+        job = Job(self, function, args, kwargs, outputs or {}, priority, group, tag)
+        self.lock.acquire()
+        heapq.heappush(self.queue, (-priority, next(self.order), job.version, job))
+        self.queued += 1
+        self.submitted += 1
+        self.lock.release()
+        self.dispatch()
+        return job
+
+    def dispatch(self) -> None:
+        """
+        Hand the most important queued jobs to the executor while there are free slots
+        """
+        while True:
+            self.lock.acquire()
+            if not self.free_flags or self.closed:
+                self.lock.release()
+                return
+            job = None
+            while self.queue:
+                _, _, version, candidate = heapq.heappop(self.queue)
+                if version == candidate.version and not candidate.done():
+                    job = candidate
+                    break
+            if job is None:
+                self.lock.release()
+                return
+            self.queued -= 1
+            job.set_running_or_notify_cancel()
+            job.slot = self.free_flags.pop()
+            self.flags[job.slot] = 0
+            self.running.add(job)
+            self.lock.release()
+
+            # Allocate the outputs only now, queued jobs hold no shared memory
+            segments = {}
+            described = {}
+            try:
+                for name, (shape, dtype) in job.outputs.items():
+                    shape = (shape,) if np.isscalar(shape) else tuple(shape)
+                    dtype = np.dtype(dtype)
+                    segment = self.memory.acquire(max(int(np.prod(shape)) * dtype.itemsize, 1))
+                    segments[name] = segment
+                    described[name] = (segment.name, shape, dtype)
+                task = self.executor.submit(
+                    run_job, job.function, job.args, job.kwargs, described,
+                    self.flags_segment.name, job.slot
+                )
+            except BaseException as error:
+                for segment in segments.values():
+                    self.memory.release(segment)
+                self.retire(job)
+                job.set_exception(error)
+                continue
+            task.add_done_callback(lambda task, job=job, segments=segments, described=described: self.finish(task, job, segments, described))
+
+    def retire(self, job) -> None:
+        """
+        Free the dispatch slot and the submit slot of a job which stopped running
+        """
+        self.lock.acquire()
+        self.running.discard(job)
+        if job.slot is not None:
+            self.flags[job.slot] = 0
+            self.free_flags.append(job.slot)
+            job.slot = None
+        self.lock.release()
+        self.slots.release()
+
+    def finish(self, task, job, segments, described) -> None:
+        """
+        Resolve a finished job, runs in the thread of the executor.
+        Stale and cancelled results are dropped before anything is mapped.
+        """
+        self.retire(job)
+        self.dispatch()
+
+        failed = task.cancelled() or task.exception() is not None
+        if failed or job.cancel_requested or job.stale:
+            for segment in segments.values():
+                self.memory.release(segment)
+            self.lock.acquire()
+            if failed and not task.cancelled():
+                self.failed += 1
+            else:
+                self.dropped += 1
+            self.lock.release()
+            if failed and not task.cancelled():
+                job.set_exception(task.exception())
+            else:
+                job.set_exception(CancelledError())
+            return
+
+        arrays = {
+            name: np.ndarray(shape, dtype=dtype, buffer=segments[name].buf)
+            for name, (_, shape, dtype) in described.items()
+        }
+        self.lock.acquire()
+        self.completed += 1
+        self.lock.release()
+        job.set_result(JobResult(task.result(), arrays, segments, self.memory))
+
+    def cancel(self, job) -> bool:
+        """
+        Cancel a job: a queued one never starts, a running one is asked to stop
+        and its result is dropped. Returns False if the job already finished.
+        """
+        self.lock.acquire()
+        if job.done():
+            self.lock.release()
+            return False
+        if job in self.running:
+            job.cancel_requested = True
+            if job.slot is not None:
+                self.flags[job.slot] = 1
+            self.lock.release()
+            return True
+        # Still queued, its heap entry is skipped from now on
+        job.version += 1
+        self.queued -= 1
+        self.dropped += 1
+        self.lock.release()
+        Future.cancel(job)
+        self.slots.release()
+        return True
+
+    def reprioritize(self, job, priority) -> None:
+        """
+        Move a queued job to a new priority, running and finished jobs are left alone
+        """
+        self.lock.acquire()
+        if not job.done() and job not in self.running:
+            job.version += 1
+            job.priority = priority
+            heapq.heappush(self.queue, (-priority, next(self.order), job.version, job))
+        self.lock.release()
+
+    def reprioritize_all(self, priority) -> int:
+        """
+        Recompute the priority of every queued job with `priority(job)`, e.g. after the camera moved.
+        A priority of None cancels the job. Returns the number of cancelled jobs.
+        """
+        self.lock.acquire()
+        jobs = [job for _, _, version, job in self.queue if version == job.version and not job.done()]
+        self.lock.release()
+
+        dropped = 0
+        for job in jobs:
+            value = priority(job)
+            if value is None:
+                dropped += self.cancel(job)
+            elif value != job.priority:
+                self.reprioritize(job, value)
+
+        # Compact the heap, reprioritizing leaves old entries behind
+        self.lock.acquire()
+        self.queue = [entry for entry in self.queue if entry[2] == entry[3].version and not entry[3].done()]
+        heapq.heapify(self.queue)
+        self.lock.release()
+        return dropped
+
+    def advance(self, group=None) -> int:
+        """
+        Start a new epoch for a group, e.g. when the LOD target changed.
+        Every older job of the group is cancelled and late results are dropped.
+        Returns the new epoch.
+        """
+        self.lock.acquire()
+        epoch = self.epochs[group] = self.epochs.get(group, 0) + 1
+        jobs = [job for _, _, version, job in self.queue if version == job.version and job.group == group]
+        jobs += [job for job in self.running if job.group == group]
+        self.lock.release()
+        for job in jobs:
+            self.cancel(job)
+        return epoch
+
+    def map(self, function, items, outputs=None, priority=0, group=None) -> list:
+        """
+        Submit `function(item)` for every item, blocking for free slots as needed
+        """
+        return [self.submit(function, item, outputs=outputs, priority=priority, group=group, tag=item) for item in items]
+
+    def shutdown(self, wait=True, cancel=False) -> None:
+        """
+        Stop the workers and unlink the shared memory.
+        With cancel=True (or wait=False), queued jobs are cancelled instead of run.
+        """
+        if self.closed:
+            return
+        logger.info('[core/JobSystem] Shutting down workers...')
+        self.lock.acquire()
+        queued = [job for _, _, version, job in self.queue if version == job.version]
+        self.lock.release()
+        if cancel or not wait:
+            for job in queued:
+                self.cancel(job)
+        else:
+            wait_futures(queued + list(self.running))
+        self.closed = True
+        self.executor.shutdown(wait=wait, cancel_futures=cancel)
+        self.memory.close()
+        SharedMemoryPool.destroy(self.flags_segment)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Snapshot of the job counters and the shared memory pool
+        """
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": len(self.running),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            **self.memory.stats,
+        }
@@ -0,0 +1,253 @@
+# Imports
+import timeit
+import numpy as np
+
+# Default constants
+SPLIT_DISTANCE = 1.5 # Split a node when the camera is closer than this many node radii
+MERGE_DISTANCE = 2.0 # Merge it back beyond this, the gap stops nodes from flickering
+MAX_LEVEL = 16 # Depth of the deepest nodes, the roots are level 0
+SPLIT_LIMIT = 64 # Nodes split per update, the nearest ones first
+INITIAL_NODES = 1024
+
+# Node flags
+ALIVE = 1
+SPLIT = 2 # Has four children, which replace it on screen
+
+# The six faces of the cube, corners going around each face like the old planet/sphere.py
+FACES = np.array([
+    [(1, 1, -1), (1, 1, 1), (-1, 1, 1), (-1, 1, -1)], # Top
+    [(1, -1, 1), (1, -1, -1), (-1, -1, -1), (-1, -1, 1)], # Bottom
+    [(-1, 1, -1), (-1, 1, 1), (-1, -1, 1), (-1, -1, -1)], # Left
+    [(1, 1, 1), (1, 1, -1), (1, -1, -1), (1, -1, 1)], # Right
+    [(1, 1, 1), (1, -1, 1), (-1, -1, 1), (-1, 1, 1)], # Front
+    [(-1, 1, -1), (-1, -1, -1), (1, -1, -1), (1, 1, -1)], # Back
+], dtype=np.float64)
+
+# A quad split in four: points are the 4 corners, then the edge midpoints (1-2, 2-3, 3-4, 4-1) and the middle
+CHILD_CORNERS = np.array([
+    (0, 4, 8, 7),
+    (4, 1, 5, 8),
+    (8, 5, 2, 6),
+    (7, 8, 6, 3),
+])
+
+class QuadTree:
+    """
+    Level of detail for a cube-sphere planet: six quadtrees, one per cube face, stored as
+    flat arrays instead of node objects. A node is an integer handle into the arrays, and the
+    four children of a node always sit next to each other, so one index finds all of them.
+    update() decides every split and merge in a single vectorized pass over all nodes.
+    """
+
+    def __init__(self, radius=1024, center=(0, 0, 0), max_level=MAX_LEVEL, height=0.0, capacity=INITIAL_NODES) -> None:
+        """
+        Allocate the node arrays and create the six root nodes.
+        `height` is the most the terrain rises above the radius, it pads the bounding spheres.
+        """
+        self.radius = radius
+        self.center = np.asarray(center, dtype=np.float64)
+        self.max_level = max_level
+        self.height = height
+        self.capacity = 0
+        self.count = 0 # Handles in use or freed, everything past it is untouched
+        self.free = [] # First handles of freed blocks of four
+        self.allocate(max(capacity, 6))
+
+        roots = self.take(6)
+        self.flags[roots] = ALIVE
+        self.parents[roots] = -1
+        self.levels[roots] = 0
+        self.faces[roots] = np.arange(6)
+        self.place(roots, FACES * radius)
+
+    def allocate(self, capacity) -> None:
+        """
+        Grow the node arrays to hold `capacity` nodes
+        """
+        def grow(array, shape, dtype, fill=0):
+            grown = np.full(shape, fill, dtype=dtype)
+            if array is not None:
+                grown[tuple(slice(0, length) for length in array.shape)] = array
+            return grown
+
+        first = not self.capacity
+        self.quads = grow(None if first else self.quads, (capacity, 4, 3), np.float64) # Corners on the cube, relative to the center
+        self.centers = grow(None if first else self.centers, (capacity, 3), np.float64) # On the sphere
+        self.radii = grow(None if first else self.radii, capacity, np.float64) # Of the bounding spheres
+        self.levels = grow(None if first else self.levels, capacity, np.int32)
+        self.faces = grow(None if first else self.faces, capacity, np.int8)
+        self.parents = grow(None if first else self.parents, capacity, np.int32, -1)
+        self.children = grow(None if first else self.children, capacity, np.int32, -1) # First of the four
+        self.flags = grow(None if first else self.flags, capacity, np.uint8)
+
+        # What update() reads, in float32 and with the flags folded in: the squared distance below
+        # which a node splits is negative unless it can split, the one above which it merges is
+        # infinite unless all its children are leaves. The centers are stored as rows, so each axis is contiguous.
+        self.points = grow(None if first else self.points, (3, capacity), np.float32)
+        self.split_ranges = grow(None if first else self.split_ranges, capacity, np.float32, -1)
+        self.merge_ranges = grow(None if first else self.merge_ranges, capacity, np.float32, np.inf)
+        self.distances = np.empty(capacity, dtype=np.float32)
+        self.scratch = np.empty(capacity, dtype=np.float32)
+        self.capacity = capacity
+
+    def take(self, count) -> np.ndarray:
+        """
+        Handles for `count` new nodes, marked alive. Blocks of four reuse freed blocks.
+        """
+        if count == 4 and self.free:
+            start = self.free.pop()
+        else:
+            start = self.count
+            if start + count > self.capacity:
+                self.allocate(max(start + count, self.capacity * 2))
+            self.count += count
+        return np.arange(start, start + count)
+
+    def refresh(self, handles) -> None:
+        """
+        Recompute the update() ranges of nodes after they or their children changed.
+        Only leaves below the deepest level can split, and only split nodes whose children are all leaves can merge.
+        """
+        handles = np.asarray(handles, dtype=np.intp)
+        flags = self.flags[handles]
+        radii = self.radii[handles]
+        can_split = (flags == ALIVE) & (self.levels[handles] < self.max_level)
+        can_merge = (flags & SPLIT).astype(bool)
+        children = self.children[handles[can_merge]][:, None] + np.arange(4)
+        can_merge[can_merge] = ~(self.flags[children] & SPLIT).any(axis=1)
+        self.split_ranges[handles] = np.where(can_split, (radii * SPLIT_DISTANCE) ** 2, -1)
+        self.merge_ranges[handles] = np.where(can_merge, (radii * MERGE_DISTANCE) ** 2, np.inf)
+
+    def refresh_parents(self, handles) -> None:
+        """
+        Refresh the parents of nodes which were split or merged, they may have stopped or started being able to merge
+        """
+        parents = self.parents[handles]
+        self.refresh(np.unique(parents[parents >= 0]))
+
+    def place(self, handles, quads) -> None:
+        """
+        Set the cube corners of nodes, and their bounding spheres on the planet
+        """
+        self.quads[handles] = quads
+        corners = quads / np.linalg.norm(quads, axis=2, keepdims=True) * self.radius
+        middles = quads.mean(axis=1)
+        middles *= self.radius / np.linalg.norm(middles, axis=1, keepdims=True)
+        self.centers[handles] = middles + self.center
+        self.points[:, handles] = self.centers[handles].T
+        self.radii[handles] = np.linalg.norm(corners - middles[:, None], axis=2).max(axis=1) + self.height
+        self.refresh(handles)
+
+    def split(self, handles) -> np.ndarray:
+        """
+        Give leaf nodes their four children, returns the new handles
+        """
+        handles = np.asarray(handles, dtype=np.intp)
+        if not len(handles):
+            return np.zeros(0, dtype=np.intp)
+        quads = self.quads[handles]
+        points = np.concatenate((quads, (quads + np.roll(quads, -1, axis=1)) / 2, quads.mean(axis=1, keepdims=True)), axis=1)
+        children = np.concatenate([self.take(4) for _ in range(len(handles))])
+        self.children[handles] = children[::4]
+        self.flags[handles] |= SPLIT
+        self.flags[children] = ALIVE
+        self.parents[children] = np.repeat(handles, 4)
+        self.levels[children] = np.repeat(self.levels[handles] + 1, 4)
+        self.faces[children] = np.repeat(self.faces[handles], 4)
+        self.children[children] = -1
+        self.place(children, points[:, CHILD_CORNERS].reshape(-1, 4, 3))
+        self.refresh(handles)
+        self.refresh_parents(handles)
+        return children
+
+    def merge(self, handles) -> np.ndarray:
+        """
+        Drop the children of nodes whose children are all leaves, returns the removed handles
+        """
+        handles = np.asarray(handles, dtype=np.intp)
+        if not len(handles):
+            return np.zeros(0, dtype=np.intp)
+        children = (self.children[handles][:, None] + np.arange(4)).reshape(-1)
+        if (self.flags[children] & SPLIT).any():
+            raise ValueError('[core/QuadTree] Only nodes whose children are leaves can merge!')
+        self.flags[children] = 0
+        self.refresh(children)
+        self.children[handles] = -1
+        self.flags[handles] &= ~np.uint8(SPLIT)
+        self.refresh(handles)
+        self.refresh_parents(handles)
+        self.free.extend(children[::4].tolist())
+        return children
+
+    def decide(self, camera, split_limit=SPLIT_LIMIT) -> tuple:
+        """
+        The vectorized pass of update(): which nodes to split and which to merge for a camera position.
+        Returns the (splitting, merging) handles without changing the tree.
+        """
+        count = self.count
+        camera = np.asarray(camera, dtype=np.float32)
+        distances, scratch = self.distances[:count], self.scratch[:count]
+        np.subtract(self.points[0, :count], camera[0], out=distances)
+        np.multiply(distances, distances, out=distances)
+        for axis in (1, 2):
+            np.subtract(self.points[axis, :count], camera[axis], out=scratch)
+            np.multiply(scratch, scratch, out=scratch)
+            np.add(distances, scratch, out=distances)
+
+        # Leaves too close for their detail split, nearest (relative to their size) first
+        splitting = np.flatnonzero(distances < self.split_ranges[:count])
+        if len(splitting) > split_limit:
+            closeness = distances[splitting] / self.split_ranges[splitting]
+            splitting = splitting[np.argpartition(closeness, split_limit)[:split_limit]]
+
+        # Split nodes far enough away to merge, deeper levels merge first and their parents on later calls
+        merging = np.flatnonzero(distances > self.merge_ranges[:count])
+        return splitting, merging
+
+    def update(self, camera, split_limit=SPLIT_LIMIT) -> tuple:
+        """
+        Split the leaves near the camera and merge the nodes far from it, one level per call.
+        Returns the (created, removed) handles, so their chunks can be requested or dropped.
+        """
+        splitting, merging = self.decide(camera, split_limit)
+        removed = self.merge(merging)
+        created = self.split(splitting[self.flags[splitting] == ALIVE])
+        return created, removed
+
+    def leaves(self) -> np.ndarray:
+        """
+        Handles of the nodes on screen: alive and not split
+        """
+        return np.flatnonzero(self.flags[:self.count] == ALIVE)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Node counts
+        """
+        flags = self.flags[:self.count]
+        alive = flags & ALIVE
+        return {
+            "nodes": int(np.count_nonzero(alive)),
+            "leaves": int(np.count_nonzero(flags == ALIVE)),
+            "depth": int(self.levels[:self.count][alive.astype(bool)].max()),
+            "capacity": self.capacity,
+            "free": len(self.free) * 4,
+        }
+
+def benchmark(levels=7, number=200) -> dict:
+    """
+    Time the LOD pass over a tree split evenly down to `levels`, 131070 nodes for 7, in milliseconds
+    """
+    tree = QuadTree(radius=6_000_000, max_level=MAX_LEVEL)
+    for _ in range(levels):
+        tree.split(tree.leaves())
+    camera = (0, 6_000_100, 0)
+    return {
+        "nodes": tree.stats["nodes"],
+        "decide": timeit.timeit(lambda: tree.decide(camera), number=number) / number * 1000,
+    }
+
+if __name__ == "__main__":
+    results = benchmark()
+    print(f"{results['nodes']} nodes: {results['decide']:.3f} ms per LOD pass")
@@ -0,0 +1,143 @@
+# Imports
+from threading import Lock
+
+# Default constants
+DEFAULT_CPU_BUDGET = 1024 * 1024 * 1024
+DEFAULT_GPU_BUDGET = 512 * 1024 * 1024
+
+class MemoryManager:
+    """
+    Keeps the CPU and GPU memory of tracked meshes under separate byte budgets.
+    When a budget is exceeded, the least recently drawn meshes are evicted,
+    GPU data first and CPU arrays only if that was not enough.
+    The owner of a mesh decides what eviction means through the callbacks given to track().
+    """
+
+    def __init__(self, cpu_budget=DEFAULT_CPU_BUDGET, gpu_budget=DEFAULT_GPU_BUDGET) -> None:
+        """
+        Initialize the usage tables and counters
+        """
+        self.cpu_budget = cpu_budget
+        self.gpu_budget = gpu_budget
+        self.lock = Lock()
+
+        self.handlers = {} # id -> (evict_gpu, evict_cpu)
+        self.cpu = {} # id -> resident CPU bytes
+        self.gpu = {} # id -> resident GPU bytes
+        self.cpu_bytes = 0
+        self.gpu_bytes = 0
+
+        # Least recently used bookkeeping, in frames
+        self.frame = 0
+        self.last_used = {}
+
+        # Statistics
+        self.gpu_evictions = 0
+        self.cpu_evictions = 0
+
+    def track(self, id, evict_gpu, evict_cpu) -> None:
+        """
+        Start tracking a mesh, the callbacks are called with its id to evict it
+        """
+        self.lock.acquire()
+        self.handlers[id] = (evict_gpu, evict_cpu)
+        self.last_used[id] = self.frame
+        self.lock.release()
+
+    def untrack(self, id) -> None:
+        """
+        Stop tracking a mesh and forget its usage
+        """
+        self.lock.acquire()
+        self.handlers.pop(id, None)
+        self.last_used.pop(id, None)
+        self.cpu_bytes -= self.cpu.pop(id, 0)
+        self.gpu_bytes -= self.gpu.pop(id, 0)
+        self.lock.release()
+
+    def set_usage(self, id, cpu=None, gpu=None) -> None:
+        """
+        Record how many bytes a mesh currently uses, None leaves a value unchanged
+        """
+        self.lock.acquire()
+        if id not in self.handlers:
+            self.lock.release()
+            return
+        if cpu is not None:
+            self.cpu_bytes += cpu - self.cpu.get(id, 0)
+            self.cpu[id] = cpu
+        if gpu is not None:
+            self.gpu_bytes += gpu - self.gpu.get(id, 0)
+            self.gpu[id] = gpu
+        self.lock.release()
+
+    def touch(self, ids) -> None:
+        """
+        Mark meshes as drawn in a new frame
+        """
+        self.frame += 1
+        frame = self.frame
+        last_used = self.last_used
+        for id in ids:
+            last_used[id] = frame
+
+    def mark(self, id) -> None:
+        """
+        Mark a single mesh as used in the current frame, e.g. because it was just loaded
+        """
+        self.last_used[id] = self.frame
+
+    def evict(self, usage, budget, handler) -> list:
+        """
+        Evict from one usage table until it fits in the budget.
+        Meshes used in the current frame are never evicted.
+        """
+        self.lock.acquire()
+        excess = sum(usage.values()) - budget
+        if excess <= 0:
+            self.lock.release()
+            return []
+
+        # Oldest first
+        last_used = dict(self.last_used)
+        candidates = sorted(
+            (id for id in usage if usage[id] and last_used.get(id, 0) < self.frame),
+            key=lambda id: last_used.get(id, 0)
+        )
+        victims = []
+        for id in candidates:
+            if excess <= 0:
+                break
+            excess -= usage[id]
+            victims.append((id, self.handlers[id][handler]))
+        self.lock.release()
+
+        # Call outside of the lock, the callbacks usually report the new usage
+        for id, callback in victims:
+            callback(id)
+        return [id for id, _ in victims]
+
+    def enforce(self) -> tuple:
+        """
+        Evict meshes until both budgets are met.
+        Returns the ids evicted from the GPU and from the CPU.
+        """
+        gpu = self.evict(self.gpu, self.gpu_budget, 0)
+        self.gpu_evictions += len(gpu)
+        cpu = self.evict(self.cpu, self.cpu_budget, 1)
+        self.cpu_evictions += len(cpu)
+        return gpu, cpu
+
+    @property
+    def stats(self) -> dict:
+        """
+        Snapshot of the current usage and the eviction counters
+        """
+        return {
+            "cpu_bytes": self.cpu_bytes,
+            "gpu_bytes": self.gpu_bytes,
+            "cpu_budget": self.cpu_budget,
+            "gpu_budget": self.gpu_budget,
+            "gpu_evictions": self.gpu_evictions,
+            "cpu_evictions": self.cpu_evictions,
+        }
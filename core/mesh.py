@@ -1,8 +1,12 @@
 # Imports
+import time
+import ctypes
 import numpy as np
 from uuid import uuid4
 from threading import Lock
 from OpenGL.arrays import vbo
+from core.culling import Frustum, compute_bounds
+from core.profiler import PROFILER
 from OpenGL.GL import (
     glClear,
     glEnableClientState,
@@ -14,41 +18,453 @@ from OpenGL.GL import (
     glDisable,
     glVertexPointer,
     glColorPointer,
+    glNormalPointer,
     glDrawArrays,
+    glDrawElements,
+    glFenceSync,
+    glClientWaitSync,
+    glDeleteSync,
+    glFlush,
+    glGenBuffers,
+    glDeleteBuffers,
+    glBindBuffer,
+    glBufferData,
+    glBufferSubData,
+    glCopyBufferSubData,
+    glMultiDrawElements,
     
     GL_COLOR_BUFFER_BIT,
     GL_DEPTH_BUFFER_BIT,
     GL_VERTEX_ARRAY,
     GL_COLOR_ARRAY,
+    GL_NORMAL_ARRAY,
     GL_DEPTH_TEST,
     GL_TRIANGLES,
     GL_TRUE,
     GL_FLOAT,
+    GL_UNSIGNED_BYTE,
+    GL_UNSIGNED_INT,
     GL_LEQUAL,
+    GL_SYNC_GPU_COMMANDS_COMPLETE,
+    GL_ALREADY_SIGNALED,
+    GL_CONDITION_SATISFIED,
+    GL_ARRAY_BUFFER,
+    GL_ELEMENT_ARRAY_BUFFER,
+    GL_COPY_READ_BUFFER,
+    GL_COPY_WRITE_BUFFER,
+    GL_DYNAMIC_DRAW,
 )
 
 # Default constants
-DEFAULT_VBO_SIZE = 1024 * 3
+DEFAULT_VERTEX_COUNT = 1024
+DEFAULT_ARENA_SIZE = 16 * 1024 # Initial elements, arenas double whenever they fill up
+SLOT_ALIGNMENT = 3 # One triangle, so slots never split a triangle in half
+DEFAULT_POOL_CAP = 256 * 1024 * 1024 # Bytes the array pool may keep around unused
+MIN_SIZE_CLASS = 64 # Smallest pooled array, in elements
+UPDATE_RATE = 20_000_000 # Initial guess of the vertices per second an update gets through
+
+def pack_colors(colors) -> np.ndarray:
+    """
+    Convert colors to normalized RGBA8.
+    Float colors are expected in the 0-1 range, missing alpha becomes opaque.
+    """
+    colors = np.asarray(colors)
+    if colors.ndim == 1:
+        colors = colors.reshape(-1, 3)
+    if colors.dtype.kind == "f":
+        colors = np.rint(np.clip(colors, 0.0, 1.0) * 255)
+    packed = np.full((len(colors), 4), 255, dtype=np.uint8)
+    packed[:, :colors.shape[1]] = colors
+    return packed
+
+class VertexLayout:
+    """
+    Describes how a single vertex is laid out in an interleaved buffer.
+    Positions (and normals, if enabled) are float32, colors are normalized RGBA8.
+    """
+    
+    def __init__(self, normals=False) -> None:
+        """
+        Build the structured dtype for the layout
+        """
+        fields = [("position", np.float32, 3)]
+        if normals:
+            fields.append(("normal", np.float32, 3))
+        fields.append(("color", np.uint8, 4))
+        
+        self.normals = normals
+        self.dtype = np.dtype(fields)
+        self.stride = self.dtype.itemsize
+        
+    def offset(self, name) -> int:
+        """
+        Byte offset of a field inside a vertex
+        """
+        return self.dtype.fields[name][1]
+    
+    def allocate(self, count) -> np.ndarray:
+        """
+        Allocate a zeroed array of `count` vertices
+        """
+        return np.zeros(count, dtype=self.dtype)
+    
+    def pack(self, positions, colors=None, normals=None) -> np.ndarray:
+        """
+        Interleave positions, colors and normals into a new array.
+        Flat arrays are accepted and reshaped, so old style data still works.
+        """
+        positions = np.asarray(positions).reshape(-1, 3)
+        data = self.allocate(len(positions))
+        self.fill(data, positions, colors, normals)
+        return data
+    
+    def fill(self, data, positions, colors=None, normals=None) -> None:
+        """
+        Like pack(), but writes into an existing array of the right length
+        """
+        data["position"] = np.asarray(positions).reshape(-1, 3)
+        if colors is not None:
+            data["color"] = pack_colors(np.asarray(colors).reshape(len(data), -1))
+        else:
+            data["color"] = 255
+        if normals is not None and self.normals:
+            data["normal"] = np.asarray(normals).reshape(-1, 3)
+    
+    def enable(self) -> None:
+        """
+        Enable the client states used by this layout
+        """
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        if self.normals:
+            glEnableClientState(GL_NORMAL_ARRAY)
+            
+    def disable(self) -> None:
+        """
+        Disable the client states used by this layout
+        """
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+        if self.normals:
+            glDisableClientState(GL_NORMAL_ARRAY)
+    
+    def point(self, buffer=None) -> None:
+        """
+        Point GL at the fields of a bound interleaved VBO.
+        Without a VBO object, the offsets are relative to whatever buffer is bound.
+        """
+        def field(name):
+            if buffer is None:
+                return ctypes.c_void_p(self.offset(name))
+            return buffer + self.offset(name)
+        
+        glVertexPointer(3, GL_FLOAT, self.stride, field("position"))
+        glColorPointer(4, GL_UNSIGNED_BYTE, self.stride, field("color"))
+        if self.normals:
+            glNormalPointer(GL_FLOAT, self.stride, field("normal"))
+
+DEFAULT_LAYOUT = VertexLayout()
+
+def poll_fence(fence) -> bool:
+    """
+    Return whether a fence was signalled, without waiting for it
+    """
+    status = glClientWaitSync(fence, 0, 0)
+    return status in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED)
+
+def weld(data) -> tuple:
+    """
+    Merge identical vertices of a triangle soup.
+    Returns (unique vertices, uint32 indices), unique vertices keep their first-seen order.
+    """
+    # Compare whole vertices as raw bytes, folding -0.0 into 0.0 first
+    data = np.ascontiguousarray(data).copy()
+    data["position"] += 0.0
+    keys = data.view(np.dtype((np.void, data.dtype.itemsize)))
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    
+    # np.unique sorts the vertices, put them back in order of appearance
+    order = np.argsort(first, kind="stable")
+    remap = np.empty(len(order), dtype=np.uint32)
+    remap[order] = np.arange(len(order), dtype=np.uint32)
+    return data[first[order]], remap[inverse.reshape(-1)]
+
+class ArrayPool:
+    """
+    Recycles mesh arrays in power of two size classes, per dtype.
+    Releasing an array keeps it around for the next acquire of the same class,
+    as long as the unused arrays stay under `cap` bytes.
+    """
+    
+    def __init__(self, cap=DEFAULT_POOL_CAP) -> None:
+        """
+        Initialize the free lists and the statistics
+        """
+        self.cap = cap
+        self.lock = Lock()
+        self.free = {} # (dtype, size class) -> list of unused arrays
+        self.lent = {} # id -> array currently handed out, the reference keeps the id from being reused
+        
+        # Statistics
+        self.cached_bytes = 0
+        self.used_bytes = 0
+        self.high_water = 0 # Highest used_bytes + cached_bytes seen
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0 # Releases which did not fit under the cap
+        
+    @staticmethod
+    def size_class(count) -> int:
+        """
+        The smallest size class which can hold `count` elements
+        """
+        return max(1 << (max(count, 1) - 1).bit_length(), MIN_SIZE_CLASS)
+    
+    def acquire(self, count, dtype) -> np.ndarray:
+        """
+        Hand out an array of at least `count` elements, its contents are undefined
+        """
+        dtype = np.dtype(dtype)
+        size = self.size_class(count)
+        self.lock.acquire()
+        arrays = self.free.get((dtype, size))
+        if arrays:
+            array = arrays.pop()
+            self.cached_bytes -= array.nbytes
+            self.hits += 1
+        else:
+            array = None
+            self.misses += 1
+        self.lock.release()
+        
+        # Allocate outside the lock, it is the slow path
+        if array is None:
+            array = np.empty(size, dtype=dtype)
+        
+        self.lock.acquire()
+        self.lent[id(array)] = array
+        self.used_bytes += array.nbytes
+        self.high_water = max(self.high_water, self.used_bytes + self.cached_bytes)
+        self.lock.release()
+        return array
+    
+    def release(self, array) -> None:
+        """
+        Give an array back to the pool, arrays which did not come from it are ignored
+        """
+        self.lock.acquire()
+        if array is None or self.lent.get(id(array)) is not array:
+            self.lock.release()
+            return
+        del self.lent[id(array)]
+        self.used_bytes -= array.nbytes
+        if self.cached_bytes + array.nbytes <= self.cap:
+            self.free.setdefault((array.dtype, len(array)), []).append(array)
+            self.cached_bytes += array.nbytes
+        else:
+            self.dropped += 1
+        self.lock.release()
+        
+    def grow(self, array, count) -> np.ndarray:
+        """
+        Move an array to a size class which can hold `count` elements, keeping its contents.
+        Returns the same array if it is already big enough.
+        """
+        if count <= len(array):
+            return array
+        return self.move(array, count)
+    
+    def move(self, array, count, length=None) -> np.ndarray:
+        """
+        Copy an array into a pooled array of at least `count` elements and release it.
+        Only the first `length` elements are copied if given, the rest is not in use.
+        Also used to take over arrays which did not come from the pool, like read-only memmaps.
+        Pass the array itself and not a view of it, or it is never released.
+        """
+        new = self.acquire(count, array.dtype)
+        length = min(len(array) if length is None else length, count)
+        new[:length] = array[:length]
+        self.release(array)
+        return new
+    
+    def trim(self) -> None:
+        """
+        Drop every cached array
+        """
+        self.lock.acquire()
+        self.free = {}
+        self.cached_bytes = 0
+        self.lock.release()
+    
+    @property
+    def stats(self) -> dict:
+        """
+        Snapshot of the pool statistics
+        """
+        return {
+            "used_bytes": self.used_bytes,
+            "cached_bytes": self.cached_bytes,
+            "high_water": self.high_water,
+            "hits": self.hits,
+            "misses": self.misses,
+            "dropped": self.dropped,
+        }
+
+POOL = ArrayPool()
 
 class Mesh:
     """
     A mesh used for storing a bunch of points and the colors of those points
     """
     
-    def __init__(self) -> None:
+    def __init__(self, id=None, owner=None, layout=DEFAULT_LAYOUT, count=DEFAULT_VERTEX_COUNT) -> None:
         """
-        Just initialize the empty arrays of the required size
+        Just initialize the empty arrays of the required size.
+        The arrays are views into bigger arrays from the pool, so the mesh can grow in place.
         """
+        self.id = id or str(uuid4())
+        self.owner = owner # The UnifiedMesh this mesh belongs to, if any
         self.changed = False
+        self.disposed = False # Set by dispose(), other threads may still hold the mesh
         self.lock = Lock()
-        self.vertices = np.empty(DEFAULT_VBO_SIZE, dtype=np.float64)
-        self.colors = np.empty(DEFAULT_VBO_SIZE, dtype=np.float64)
+        self.layout = layout
+        self.storage = POOL.acquire(count, layout.dtype) if count else layout.allocate(0)
+        self.data = self.storage[:count]
+        self.data[:] = 0
+        self.index_storage = None
+        self.indices = None # uint32 triangle indices, None for a triangle soup
+        self.update_bounds()
+        
+    def update_bounds(self) -> None:
+        """
+        Recompute the bounding box and sphere, call this with the lock held
+        after changing the vertices in place. set_data() does it by itself.
+        """
+        self.bounds_min, self.bounds_max, self.center, self.radius = compute_bounds(self.data["position"])
+        
+    def resize(self, count, index_count=None) -> None:
+        """
+        Resize the mesh to `count` vertices (and `index_count` indices, None drops them).
+        The mesh only moves to a bigger pooled array if it outgrew its size class.
+        Read-only arrays (see adopt()) are copied into the pool first.
+        Call this with the lock held, the new elements are not initialized.
+        """
+        if count > len(self.storage) or not self.storage.flags.writeable:
+            self.storage = POOL.move(self.storage, count, len(self.data))
+        self.data = self.storage[:count]
+        
+        if index_count is None:
+            POOL.release(self.index_storage)
+            self.index_storage = None
+            self.indices = None
+            return
+        if self.index_storage is None:
+            self.index_storage = POOL.acquire(index_count, np.uint32)
+        elif index_count > len(self.index_storage) or not self.index_storage.flags.writeable:
+            self.index_storage = POOL.move(self.index_storage, index_count, len(self.indices))
+        self.indices = self.index_storage[:index_count]
+        
+    def adopt(self, data, indices=None, bounds=None) -> None:
+        """
+        Use existing arrays as the mesh data without copying them, e.g. memmaps.
+        `bounds` is an optional (min, max, center, radius) tuple, saving a pass over the data.
+        The arrays may be read-only, they are copied into the pool on the next set_data().
+        """
+        if data.dtype != self.layout.dtype:
+            raise ValueError('[core/Mesh] Adopted data does not match the vertex layout!')
+        self.lock.acquire()
+        POOL.release(self.storage)
+        POOL.release(self.index_storage)
+        self.storage = self.data = data
+        self.index_storage = self.indices = indices
+        if bounds is None:
+            self.update_bounds()
+        else:
+            self.bounds_min, self.bounds_max, self.center, self.radius = bounds
+        self.lock.release()
+        self.notify_change()
+        
+    @property
+    def vertices(self) -> np.ndarray:
+        """
+        View of the vertex positions, shape (n, 3)
+        """
+        return self.data["position"]
+    
+    @property
+    def colors(self) -> np.ndarray:
+        """
+        View of the RGBA8 vertex colors, shape (n, 4)
+        """
+        return self.data["color"]
+    
+    def set_data(self, positions, colors=None, normals=None, indices=None) -> None:
+        """
+        Replace the contents of the mesh, converting everything to its layout
+        """
+        positions = np.asarray(positions).reshape(-1, 3)
+        if indices is not None:
+            indices = np.asarray(indices).reshape(-1)
+        self.lock.acquire()
+        self.resize(len(positions), None if indices is None else len(indices))
+        self.layout.fill(self.data, positions, colors, normals)
+        if indices is not None:
+            self.indices[:] = indices
+        self.update_bounds()
+        self.lock.release()
+        self.notify_change()
+        
+    def weld(self) -> None:
+        """
+        Deduplicate the vertices of the mesh and switch it to indexed drawing
+        """
+        self.lock.acquire()
+        data, indices = weld(self.data)
+        if self.indices is not None:
+            indices = indices[self.indices]
+        self.resize(len(data), len(indices))
+        self.data[:] = data
+        self.indices[:] = indices
+        self.lock.release()
+        self.notify_change()
+        
+    def release_data(self) -> None:
+        """
+        Give the arrays back to the pool but keep the mesh, e.g. when it is evicted.
+        The mesh is empty until set_data() is called again.
+        """
+        self.lock.acquire()
+        POOL.release(self.storage)
+        POOL.release(self.index_storage)
+        self.storage = self.data = self.layout.allocate(0)
+        self.index_storage = None
+        self.indices = None
+        self.lock.release()
+        
+    @property
+    def cpu_bytes(self) -> int:
+        """
+        Bytes held by the arrays of this mesh, including unused pooled capacity
+        """
+        size = self.storage.nbytes
+        if self.index_storage is not None:
+            size += self.index_storage.nbytes
+        return size
+        
+    @property
+    def index_count(self) -> int:
+        """
+        Number of indices this mesh draws, a soup draws each vertex once
+        """
+        return len(self.data) if self.indices is None else len(self.indices)
         
     def notify_change(self) -> None:
         """
         Notify that the mesh was modified after the last update
         """
         self.changed = True
+        if self.owner is not None:
+            self.owner.dirty.add(self.id)
         
     def notify_update(self) -> None:
         """
@@ -58,103 +474,751 @@ class Mesh:
 
     def dispose(self) -> None:
         """
-        Free memory and prepare the mesh for deletion
+        Free memory and prepare the mesh for deletion.
+        The update thread may still hold the mesh, so it is left empty instead of half torn down.
+        """
+        self.lock.acquire()
+        POOL.release(self.storage)
+        POOL.release(self.index_storage)
+        self.storage = self.data = self.layout.allocate(0)
+        self.index_storage = None
+        self.indices = None
+        self.disposed = True
+        self.lock.release()
+        
+class UploadCounter:
+    """
+    Counts the bytes sent to the GPU, in total and per frame
+    """
+    
+    def __init__(self) -> None:
+        """
+        Initialize the counters
+        """
+        self.lock = Lock()
+        self.total = 0
+        self.current = 0 # Bytes uploaded since the last frame
+        self.last_frame = 0 # Bytes uploaded during the last complete frame
+        
+    def add(self, count) -> None:
+        """
+        Record an upload of `count` bytes
         """
         self.lock.acquire()
-        del self.vertices
-        del self.colors
+        self.total += count
+        self.current += count
         self.lock.release()
         
+    def next_frame(self) -> int:
+        """
+        Close the current frame and return how many bytes it uploaded
+        """
+        self.lock.acquire()
+        self.last_frame, self.current = self.current, 0
+        self.lock.release()
+        return self.last_frame
+
+UPLOADS = UploadCounter()
+
+def merge_ranges(ranges) -> list:
+    """
+    Sort (start, stop) ranges and merge the ones that overlap or touch
+    """
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
 class RenderMesh(Mesh):
     """
     A Mesh but it also stores its stuff in a VBO.
+    Only the ranges marked with mark_dirty() are uploaded again, unless the mesh streams,
+    in which case the whole buffer is orphaned and respecified on every upload.
     """
     
-    def __init__(self) -> None:
-        super().__init__()
-        self.vertex_buffer = None
-        self.color_buffer = None
+    def __init__(self, layout=DEFAULT_LAYOUT, streaming=False, count=DEFAULT_VERTEX_COUNT) -> None:
+        super().__init__(layout=layout, count=count)
+        self.buffer = None # A single interleaved VBO
+        self.index_buffer = None # Element buffer, only for indexed meshes
+        self.count = None # Number of vertices/indices to draw, None means all of them
+        self.streaming = streaming # For data which changes every frame
+        
+        # Element ranges changed since the last upload, None means everything
+        self.dirty_ranges = None
+        self.index_dirty_ranges = None
+        
+        # Static build bookkeeping, see UnifiedMesh.build_static
+        self.pending = set() # Ids of meshes whose slots must be copied again
+        self.clears = [] # (offset, capacity) index regions which must be zeroed
+        self.version = 0 # Snapshot version of the data, 0 means never built
+        self.uploaded = 0 # Snapshot version currently in the buffers
+        self.fence = None # Signalled once the last upload reached the GPU
+        
+    def mark_dirty(self, start=0, stop=None, indices=False) -> None:
+        """
+        Mark a range of vertices (or indices) to be uploaded on the next update.
+        Without a range, the whole array is uploaded.
+        """
+        attribute = "index_dirty_ranges" if indices else "dirty_ranges"
+        ranges = getattr(self, attribute)
+        if stop is None:
+            setattr(self, attribute, None)
+        elif ranges is not None:
+            ranges.append((start, stop))
+            
+    def notify_change(self) -> None:
+        """
+        Notify that the mesh was modified, everything is uploaded again
+        """
+        self.mark_dirty()
+        self.mark_dirty(indices=True)
+        super().notify_change()
         
     def create_buffers(self) -> None:
         """
         Create the buffers for the thing
         """
+        usage = "GL_STREAM_DRAW" if self.streaming else "GL_STATIC_DRAW"
         self.lock.acquire()
-        self.vertex_buffer = vbo.VBO(
-            self.vertices,
-            usage="GL_STATIC_DRAW",
-            target="GL_ARRAY_BUFFER"
-        )
-        self.color_buffer = vbo.VBO(
-            self.colors,
-            usage="GL_STATIC_DRAW",
+        self.buffer = vbo.VBO(
+            self.data.view(np.uint8),
+            usage=usage,
             target="GL_ARRAY_BUFFER"
         )
+        if self.indices is not None:
+            self.index_buffer = vbo.VBO(
+                self.indices.view(np.uint8),
+                usage=usage,
+                target="GL_ELEMENT_ARRAY_BUFFER"
+            )
+        self.dirty_ranges = None
+        self.index_dirty_ranges = None
         self.lock.release()
         
+    def write_buffer(self, buffer, target, array, ranges) -> None:
+        """
+        Upload the dirty ranges of an array to its buffer.
+        Everything is sent with glBufferData if the size changed, the mesh streams
+        or the whole array is dirty. Respecifying the data orphans the old storage,
+        so the upload never waits for draws which still use it.
+        """
+        data = array.view(np.uint8)
+        replaced = buffer.size != data.nbytes or buffer.data.ctypes.data != data.ctypes.data
+        if self.streaming or ranges is None or replaced:
+            buffer.set_array(data)
+            buffer.bind()
+            buffer.unbind()
+            UPLOADS.add(data.nbytes)
+            return
+        if not ranges:
+            return
+        
+        # Only send the bytes which changed
+        buffer.bind()
+        itemsize = array.dtype.itemsize
+        for start, stop in merge_ranges(ranges):
+            start, stop = start * itemsize, min(stop * itemsize, data.nbytes)
+            glBufferSubData(target, start, stop - start, data[start:stop])
+            UPLOADS.add(stop - start)
+        buffer.unbind()
+        
     def update_buffers(self) -> None:
         """
-        Update the buffers with self.vertices and self.colors
+        Update the buffers with the dirty parts of self.data and self.indices
         """
-        if not self.vertex_buffer and not self.color_buffer:
+        if self.buffer is None:
             return
         
         self.lock.acquire()
-        self.vertex_buffer.set_array(self.vertices)
-        self.color_buffer.set_array(self.colors)
+        self.write_buffer(self.buffer, GL_ARRAY_BUFFER, self.data, self.dirty_ranges)
+        if self.index_buffer is not None:
+            self.write_buffer(self.index_buffer, GL_ELEMENT_ARRAY_BUFFER, self.indices, self.index_dirty_ranges)
+        self.dirty_ranges = []
+        self.index_dirty_ranges = []
         self.lock.release()
         
+    def upload(self) -> None:
+        """
+        Create or update the buffers and push the data to the GPU right away.
+        A fence is left behind so other contexts can tell when the upload is done.
+        """
+        if self.buffer is None:
+            self.create_buffers()
+        self.update_buffers()
+        
+        if self.fence is not None:
+            glDeleteSync(self.fence)
+        self.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        glFlush()
+        
+    def ready(self) -> bool:
+        """
+        Return whether the last upload finished, without waiting for it
+        """
+        if self.fence is None:
+            return True
+        if not poll_fence(self.fence):
+            return False
+        glDeleteSync(self.fence)
+        self.fence = None
+        return True
+    
+    @property
+    def gpu_bytes(self) -> int:
+        """
+        Bytes held by the GL buffers of this mesh
+        """
+        size = 0
+        if self.buffer is not None:
+            size += self.buffer.size
+        if self.index_buffer is not None:
+            size += self.index_buffer.size
+        return size
+        
     def delete_buffers(self) -> None:
         """
-        If buffers exist, delete them and free up the memory
+        If the buffer exists, delete it and free up the memory
         """
-        if not self.vertex_buffer and not self.color_buffer:
+        if self.buffer is None:
             return
         
         self.lock.acquire()
-        self.vertex_buffer.delete()
-        self.color_buffer.delete()
+        self.buffer.delete()
+        self.buffer = None
+        if self.index_buffer is not None:
+            self.index_buffer.delete()
+            self.index_buffer = None
         self.lock.release()
         
     def draw(self) -> None:
         """
         Draw the mesh.
         """
-        if not self.vertex_buffer and not self.color_buffer:
+        if self.buffer is None:
             return
         
         self.lock.acquire()
         
-        # Bind and point the buffers
-        self.vertex_buffer.bind()
-        glVertexPointer(3, GL_FLOAT, 0, self.vertex_buffer.buf)
-        self.color_buffer.bind()
-        glColorPointer(3, GL_FLOAT, 0, self.color_buffer.buf)
+        # Bind the buffer and point GL at the interleaved fields
+        self.buffer.bind()
+        self.layout.point(self.buffer)
         
-        # Draw the buffers
-        glDrawArrays(GL_TRIANGLES, 0, len(self.vertices) // 3)
+        # Draw the buffer, through the element buffer if there is one
+        count = self.count if self.count is not None else self.index_count
+        if self.index_buffer is not None:
+            self.index_buffer.bind()
+            glDrawElements(GL_TRIANGLES, count, GL_UNSIGNED_INT, self.index_buffer)
+            self.index_buffer.unbind()
+        else:
+            glDrawArrays(GL_TRIANGLES, 0, count)
+        self.buffer.unbind()
         
         self.lock.release()
 
+class MeshArena:
+    """
+    Keeps track of where every mesh lives inside the static build arrays.
+    Each mesh owns a fixed slot (offset, capacity) and only moves when it outgrows it.
+    """
+    
+    def __init__(self, capacity=DEFAULT_ARENA_SIZE) -> None:
+        """
+        Initialize the slot table and the free list
+        """
+        self.capacity = capacity
+        self.end = 0 # Everything past this offset is unused
+        self.slots = {}
+        self.free = []
+        self.held = [] # (version, slot) pairs which can't be reused yet
+        
+    def fit(self, id, length, hold=None) -> tuple | None:
+        """
+        Make sure the mesh has a slot which can hold `length` elements.
+        Returns the old slot if the mesh had to move, so that it can be cleared.
+        See release() for `hold`.
+        """
+        slot = self.slots.get(id)
+        if slot is not None and length <= slot[1]:
+            return None
+        old = self.release(id, hold)
+        
+        # Reuse the first freed slot which is big enough
+        size = max(-(-length // SLOT_ALIGNMENT), 1) * SLOT_ALIGNMENT
+        for index, (offset, capacity) in enumerate(self.free):
+            if capacity < size:
+                continue
+            if capacity == size:
+                self.free.pop(index)
+            else:
+                self.free[index] = (offset + size, capacity - size)
+            self.slots[id] = (offset, size)
+            return old
+        
+        # Otherwise append it to the end, growing the arena if required
+        self.slots[id] = (self.end, size)
+        self.end += size
+        while self.end > self.capacity:
+            self.capacity = max(self.capacity * 2, SLOT_ALIGNMENT)
+        return old
+    
+    def release(self, id, hold=None) -> tuple | None:
+        """
+        Free the slot of a mesh and return it.
+        If `hold` is a version number, the slot is only reused after reclaim() reaches it,
+        for when someone might still be reading it.
+        """
+        slot = self.slots.pop(id, None)
+        if slot is None:
+            return None
+        if hold is not None:
+            self.held.append((hold, slot))
+        else:
+            self.free_slot(slot)
+        return slot
+    
+    def hold(self, slot, version) -> None:
+        """
+        Free a slot which no mesh owns anymore once reclaim() reaches `version`
+        """
+        if slot is not None:
+            self.held.append((version, slot))
+    
+    def reclaim(self, version) -> None:
+        """
+        Free every held slot whose version is not newer than `version`
+        """
+        held = []
+        for hold, slot in self.held:
+            if hold <= version:
+                self.free_slot(slot)
+            else:
+                held.append((hold, slot))
+        self.held = held
+    
+    def free_slot(self, slot) -> None:
+        """
+        Put a slot back on the free list
+        """
+        # Keep the free list sorted and merge neighbouring slots
+        free = sorted(self.free + [slot])
+        merged = [free[0]]
+        for offset, capacity in free[1:]:
+            last_offset, last_capacity = merged[-1]
+            if last_offset + last_capacity == offset:
+                merged[-1] = (last_offset, last_capacity + capacity)
+            else:
+                merged.append((offset, capacity))
+        
+        # A free slot at the very end just shrinks the arena
+        if merged[-1][0] + merged[-1][1] == self.end:
+            self.end = merged.pop(-1)[0]
+        self.free = merged
+
+class SnapshotBuffer:
+    """
+    A triple buffer of static builds.
+    The writer fills `back` and publishes it by swapping it with `middle`,
+    the reader swaps `middle` into `front` whenever a newer version was published.
+    Swapping is a couple of assignments under a tiny lock, so neither side
+    ever waits for the other to finish building or drawing.
+    """
+    
+    def __init__(self, layout=DEFAULT_LAYOUT) -> None:
+        """
+        Create the three builds, their arrays are allocated on first build
+        """
+        self.builds = [RenderMesh(layout, count=0) for _ in range(3)]
+        for build in self.builds:
+            build.indices = np.zeros(0, dtype=np.uint32)
+        self.back, self.middle, self.front = self.builds
+        self.version = 0 # Latest published version
+        self.fresh = False # Whether middle is newer than front
+        self.swap_lock = Lock()
+        
+    def publish(self, uploaded=False) -> int:
+        """
+        Publish the back build as the latest snapshot, returns its version.
+        Pass uploaded=True if its buffers already hold the new data.
+        """
+        self.swap_lock.acquire()
+        self.version += 1
+        self.back.version = self.version
+        if uploaded:
+            self.back.uploaded = self.version
+        self.back, self.middle = self.middle, self.back
+        self.fresh = True
+        self.swap_lock.release()
+        return self.version
+    
+    def acquire(self) -> RenderMesh | None:
+        """
+        Return the latest published build for drawing, None if nothing was published yet.
+        A build uploaded from another context is only swapped in once its fence is signalled.
+        """
+        self.swap_lock.acquire()
+        if self.fresh and self.middle.ready():
+            self.front, self.middle = self.middle, self.front
+            self.fresh = False
+        front = self.front
+        self.swap_lock.release()
+        return front if front.version else None
+
+# Per-mesh rows kept by MultiDrawBatch, the bounds come last
+ROW_ARRAYS = ("counts", "offsets", "flags", "centers", "radii", "mins", "maxs")
+
+# Row flags, a row is only drawn if none are set
+HIDDEN = 1
+EVICTED = 2 # The data is not on the GPU, but the bounds are kept to tell when it is needed
+
+class DrawList:
+    """
+    An immutable, versioned set of draw arrays published by a MultiDrawBatch
+    """
+    
+    def __init__(self, version, buffer, index_buffer, ids, counts, offsets, flags, bounds) -> None:
+        """
+        Store the arrays and fence the writes they depend on.
+        `bounds` holds the (centers, radii, mins, maxs) rows used for culling.
+        """
+        self.version = version
+        self.buffer = buffer
+        self.index_buffer = index_buffer
+        self.ids = ids
+        self.counts = counts
+        self.offsets = offsets
+        self.flags = flags
+        self.bounds = bounds
+        self.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        glFlush()
+        
+    def ready(self) -> bool:
+        """
+        Return whether the writes this draw list depends on reached the GPU
+        """
+        if self.fence is None:
+            return True
+        if not poll_fence(self.fence):
+            return False
+        glDeleteSync(self.fence)
+        self.fence = None
+        return True
+
+class MultiDrawBatch:
+    """
+    Keeps every mesh in its own region of one large shared GPU buffer.
+    Only the regions of changed meshes are written, and everything is drawn with a single
+    glMultiDrawElements call driven by per-mesh count/offset arrays, so hiding, showing
+    or removing a mesh never moves any vertex data.
+    A changed mesh is written to fresh slots, never over the ones a published DrawList
+    may still be drawing, which are only reused once the renderer moved past them.
+    The bounds of every mesh are kept in the same rows, so the whole batch can be
+    frustum culled with a few vectorized tests right before drawing.
+    update() needs a GL context (the update thread), draw() runs in the render thread.
+    """
+    
+    def __init__(self, layout=DEFAULT_LAYOUT) -> None:
+        """
+        Initialize the slot tables and the draw arrays, buffers are created on first update
+        """
+        self.layout = layout
+        self.arena = MeshArena()
+        self.index_arena = MeshArena()
+        self.buffer = None
+        self.index_buffer = None
+        self.capacity = 0 # Size of the GL buffers, in vertices/indices
+        self.index_capacity = 0
+        
+        # One row per mesh in the draw arrays
+        self.rows = {}
+        self.ids = []
+        self.index_counts = {}
+        self.counts = np.zeros(0, dtype=np.int32)
+        self.offsets = np.zeros(0, dtype=np.uintp) # Byte offsets into the element buffer
+        self.flags = np.zeros(0, dtype=np.uint8)
+        self.centers = np.zeros((0, 3), dtype=np.float32)
+        self.radii = np.zeros(0, dtype=np.float32)
+        self.mins = np.zeros((0, 3), dtype=np.float32)
+        self.maxs = np.zeros((0, 3), dtype=np.float32)
+        self.visible = 0 # Meshes which survived culling in the last frame
+        self.drawn_ids = [] # Ids drawn in the last frame
+        self.wanted_ids = [] # Evicted ids which were inside the frustum in the last frame
+        
+        # Versioning, slots and buffers are only reused once the renderer moved past them
+        self.version = 0
+        self.published = None
+        self.current = None
+        self.drawn = 0
+        self.retired = [] # (version, buffer) pairs waiting for deletion
+        
+    def grow(self, buffer, size, new_size, target) -> int:
+        """
+        Create a bigger buffer and copy the old contents over on the GPU
+        """
+        new = glGenBuffers(1)
+        glBindBuffer(target, new)
+        glBufferData(target, new_size, None, GL_DYNAMIC_DRAW)
+        if buffer is not None:
+            glBindBuffer(GL_COPY_READ_BUFFER, buffer)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, new)
+            glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, size)
+            glBindBuffer(GL_COPY_READ_BUFFER, 0)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+            self.retired.append((self.version + 1, buffer))
+        glBindBuffer(target, 0)
+        return new
+    
+    def add_row(self, id) -> int:
+        """
+        Give a mesh a row in the draw arrays
+        """
+        row = len(self.ids)
+        if row == len(self.counts):
+            size = max(row * 2, 64)
+            for name in ROW_ARRAYS:
+                array = getattr(self, name)
+                grown = np.zeros((size,) + array.shape[1:], dtype=array.dtype)
+                grown[:row] = array
+                setattr(self, name, grown)
+        self.ids.append(id)
+        self.rows[id] = row
+        return row
+    
+    def remove_row(self, id) -> None:
+        """
+        Remove the row of a mesh, moving the last row into its place
+        """
+        row = self.rows.pop(id)
+        last = len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self.rows[moved] = row
+            for name in ROW_ARRAYS:
+                array = getattr(self, name)
+                array[row] = array[last]
+        self.ids.pop(-1)
+        self.index_counts.pop(id, None)
+        
+    def gpu_bytes(self, id) -> int:
+        """
+        Bytes the slots of a mesh take up in the GPU buffers
+        """
+        size = 0
+        if id in self.arena.slots:
+            size += self.arena.slots[id][1] * self.layout.stride
+        if id in self.index_arena.slots:
+            size += self.index_arena.slots[id][1] * 4
+        return size
+        
+    @PROFILER.profiled("MultiDrawBatch.update")
+    def update(self, meshes, dirty, removed, toggled, hidden, evicted=()) -> set:
+        """
+        Write the changed meshes to their regions, edit the draw arrays and publish them.
+        Evicted meshes lose their slots but keep their rows, until they are written again.
+        Returns the ids which grew while being written, they have to be updated again.
+        """
+        tag = self.version + 1
+        self.arena.reclaim(self.drawn)
+        self.index_arena.reclaim(self.drawn)
+        retired = []
+        for version, buffer in self.retired:
+            if version <= self.drawn:
+                glDeleteBuffers(1, [buffer])
+            else:
+                retired.append((version, buffer))
+        self.retired = retired
+        
+        # Removing a mesh only drops its row, its slots are held until unused
+        for id in removed:
+            if id in self.rows:
+                self.remove_row(id)
+            self.arena.release(id, tag)
+            self.index_arena.release(id, tag)
+        for id in evicted:
+            if id in self.rows:
+                self.flags[self.rows[id]] |= EVICTED
+            self.arena.release(id, tag)
+            self.index_arena.release(id, tag)
+        
+        # Fit every changed mesh into fresh slots first, so the buffers grow at most once.
+        # The old slots are kept until the mesh is written, the published rows point at them.
+        moved = {}
+        for id in dirty:
+            mesh = meshes.get(id)
+            if mesh is None:
+                continue
+            moved[id] = self.arena.slots.pop(id, None), self.index_arena.slots.pop(id, None)
+            self.arena.fit(id, len(mesh.data))
+            self.index_arena.fit(id, mesh.index_count)
+        stride = self.layout.stride
+        if self.arena.capacity > self.capacity:
+            self.buffer = self.grow(self.buffer, self.capacity * stride,
+                                    self.arena.capacity * stride, GL_ARRAY_BUFFER)
+            self.capacity = self.arena.capacity
+        if self.index_arena.capacity > self.index_capacity:
+            self.index_buffer = self.grow(self.index_buffer, self.index_capacity * 4,
+                                          self.index_arena.capacity * 4, GL_ELEMENT_ARRAY_BUFFER)
+            self.index_capacity = self.index_arena.capacity
+        
+        # Write only the regions of the changed meshes
+        deferred = set()
+        for id, (old, old_index) in moved.items():
+            mesh = meshes.get(id)
+            offset, capacity = self.arena.slots[id]
+            index_offset, index_capacity = self.index_arena.slots[id]
+            if mesh is not None:
+                mesh.lock.acquire()
+            
+            # Deleted by the main thread since it was looked up, or grown meanwhile.
+            # Either way it keeps its old slots, the fresh ones were never used.
+            deleted = mesh is None or mesh.disposed or meshes.get(id) is not mesh
+            if deleted or len(mesh.data) > capacity or mesh.index_count > index_capacity:
+                if mesh is not None:
+                    mesh.lock.release()
+                if not deleted:
+                    deferred.add(id)
+                self.arena.release(id)
+                self.index_arena.release(id)
+                if old is not None:
+                    self.arena.slots[id], self.index_arena.slots[id] = old, old_index
+                continue
+            
+            data = mesh.data
+            bounds = mesh.bounds_min, mesh.bounds_max, mesh.center, mesh.radius
+            if mesh.indices is None:
+                indices = np.arange(offset, offset + len(data), dtype=np.uint32)
+            else:
+                indices = (mesh.indices + offset).astype(np.uint32)
+            glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+            glBufferSubData(GL_ARRAY_BUFFER, offset * stride, data.nbytes, data)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+            glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, index_offset * 4, indices.nbytes, indices)
+            UPLOADS.add(data.nbytes + indices.nbytes)
+            mesh.lock.release()
+            self.arena.hold(old, tag)
+            self.index_arena.hold(old_index, tag)
+            
+            row = self.rows[id] if id in self.rows else self.add_row(id)
+            self.index_counts[id] = len(indices)
+            self.counts[row] = len(indices)
+            self.flags[row] = HIDDEN if id in hidden else 0
+            self.offsets[row] = index_offset * 4
+            self.mins[row], self.maxs[row], self.centers[row], self.radii[row] = bounds
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        
+        # Hiding and showing only edits the flags
+        for id in toggled:
+            if id in self.rows:
+                if id in hidden:
+                    self.flags[self.rows[id]] |= HIDDEN
+                else:
+                    self.flags[self.rows[id]] &= ~np.uint8(HIDDEN)
+        
+        if dirty or removed or toggled or evicted or self.published is None:
+            self.version = tag
+            rows = len(self.ids)
+            self.published = DrawList(
+                tag, self.buffer, self.index_buffer, tuple(self.ids),
+                *(getattr(self, name)[:rows].copy() for name in ROW_ARRAYS[:3]),
+                tuple(getattr(self, name)[:rows].copy() for name in ROW_ARRAYS[3:])
+            )
+        return deferred
+    
+    def draw(self, frustum=None) -> None:
+        """
+        Draw every visible mesh with a single multi-draw call.
+        With a frustum, meshes outside of it are left out of the call.
+        Evicted meshes which would be drawn otherwise are reported in wanted_ids.
+        """
+        latest = self.published
+        if latest is not None and latest is not self.current and latest.ready():
+            self.current = latest
+            self.drawn = latest.version
+        current = self.current
+        if current is None:
+            return
+        
+        # Cull, leaving hidden and evicted meshes out as well
+        visible = current.flags == 0
+        evicted = current.flags == EVICTED # Hidden ones are not wanted back
+        if frustum is not None:
+            inside = frustum.test(*current.bounds)
+            visible &= inside
+            evicted &= inside
+        self.wanted_ids = [current.ids[row] for row in np.flatnonzero(evicted)]
+        rows = np.flatnonzero(visible)
+        self.drawn_ids = [current.ids[row] for row in rows]
+        self.visible = len(rows)
+        counts, offsets = current.counts[rows], current.offsets[rows]
+        if not len(counts):
+            return
+        
+        glBindBuffer(GL_ARRAY_BUFFER, current.buffer)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, current.index_buffer)
+        self.layout.point()
+        glMultiDrawElements(
+            GL_TRIANGLES, counts, GL_UNSIGNED_INT,
+            offsets.ctypes.data_as(ctypes.POINTER(ctypes.c_void_p)), len(counts)
+        )
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
 class UnifiedMesh:
     """
     A unified mesh class which handles drawcalls for every single mesh.
     """
     
-    def __init__(self) -> None:
+    def __init__(self, layout=DEFAULT_LAYOUT, multidraw=False, culling=True, memory=None) -> None:
         """
-        Initialize the mesh queue and other required stuff
+        Initialize the mesh queue and other required stuff.
+        With multidraw=True, meshes live in regions of one GPU buffer (see MultiDrawBatch)
+        instead of being copied into static builds, and are frustum culled if `culling` is set.
+        `memory` is an optional core.memory.MemoryManager which evicts meshes when over budget.
         """
+        self.layout = layout
+        self.culling = culling
+        self.memory = memory
         self.meshes = {} # The Renderer class takes care of this
-        self.static_builds = {}
-        self.sorted_ids = [] # Sorted by latest update
+        self.batch = MultiDrawBatch(layout) if multidraw else None
+        self.snapshots = None if multidraw else SnapshotBuffer(layout)
+        
+        # Incremental rebuild state, static builds are always indexed
+        self.arena = MeshArena() # Vertex slots
+        self.index_arena = MeshArena() # Index slots
+        self.dirty = set() # Filled by Mesh.notify_change
+        self.removed = set() # Deleted since the last update
+        self.hidden = set()
+        self.toggled = set() # Hidden or shown since the last update
+        
+        # Eviction state
+        self.loaders = {} # id -> callable which refills an evicted mesh
+        self.evicting = set() # To be dropped from the GPU in the next update
+        self.evicted_gpu = set()
+        self.evicted_cpu = set()
+        self.loading = set() # Loaders called, waiting for set_data()
+        self.wanted = set() # Evicted meshes which came into view
+        
+        # Measured update throughput, for time-sliced updates
+        self.rate = UPDATE_RATE
 
-    def new_mesh(self, id=str(uuid4())) -> str:
+    def new_mesh(self, id=None, loader=None) -> str:
         """
-        Adds a mesh to the mesh list and returns the id
+        Adds a mesh to the mesh list and returns the id.
+        `loader(mesh)` is called to refill the mesh if its arrays were evicted,
+        it may call mesh.set_data() right away or later, e.g. from a job.
         """
-        new = Mesh()
+        id = id or str(uuid4())
+        new = Mesh(id, self, self.layout)
         self.meshes[id] = new
+        if loader is not None:
+            self.loaders[id] = loader
+        if self.memory is not None:
+            self.memory.track(id, self.evict_gpu, self.evict_cpu)
+        new.notify_change()
         return id
     
     def delete_mesh(self, id) -> str:
@@ -163,79 +1227,310 @@ class UnifiedMesh:
         """
         self.meshes[id].dispose()
         del self.meshes[id]
-        self.update_later()
+        self.dirty.discard(id)
+        self.hidden.discard(id)
+        self.loaders.pop(id, None)
+        for evicted in (self.evicting, self.evicted_gpu, self.evicted_cpu, self.loading):
+            evicted.discard(id)
+        if self.memory is not None:
+            self.memory.untrack(id)
+        self.removed.add(id)
         return id
     
-    def update(self) -> None:
+    def evict_gpu(self, id) -> None:
+        """
+        Drop the GPU copy of a mesh, it is uploaded again once required
+        """
+        if id not in self.meshes or id in self.evicted_gpu:
+            return
+        self.evicted_gpu.add(id)
+        self.evicting.add(id)
+        if self.memory is not None:
+            self.memory.set_usage(id, gpu=0)
+        
+    def evict_cpu(self, id) -> None:
+        """
+        Drop the arrays of a mesh, its loader refills it once required.
+        Static builds are rebuilt from the arrays, so there the GPU copy goes too.
+        """
+        if id not in self.meshes or id in self.evicted_cpu:
+            return
+        self.meshes[id].release_data()
+        self.evicted_cpu.add(id)
+        if self.memory is not None:
+            self.memory.set_usage(id, cpu=0)
+        if self.batch is None:
+            self.evict_gpu(id)
+            
+    def require(self, id) -> None:
+        """
+        Bring an evicted mesh back, reloading its arrays and/or uploading it again
+        """
+        if id not in self.meshes:
+            return
+        if self.memory is not None:
+            self.memory.mark(id)
+        if id in self.evicted_cpu:
+            loader = self.loaders.get(id)
+            if loader is not None and id not in self.loading:
+                self.loading.add(id)
+                loader(self.meshes[id])
+        elif id in self.evicted_gpu:
+            self.dirty.add(id)
+    
+    def hide(self, id) -> None:
+        """
+        Stop drawing a mesh without touching its data
+        """
+        self.hidden.add(id)
+        self.toggled.add(id)
+        
+    def show(self, id) -> None:
+        """
+        Draw a previously hidden mesh again
+        """
+        self.hidden.discard(id)
+        self.toggled.add(id)
+    
+    def take_slice(self, dirty, deadline) -> set:
+        """
+        Pick as many changed meshes as the measured throughput gets through before the deadline,
+        at least one. The rest goes back to self.dirty for a later update.
+        """
+        limit = max(deadline - time.perf_counter(), 0) * self.rate
+        taken = set()
+        vertices = 0
+        for id in dirty:
+            if taken and vertices >= limit:
+                break
+            mesh = self.meshes.get(id)
+            vertices += 0 if mesh is None else len(mesh.data)
+            taken.add(id)
+        self.dirty |= dirty - taken
+        return taken
+    
+    def update(self, upload=True, deadline=None) -> bool:
         """
         Handle the creation of static meshes and update the update times
-        This function is to be called in the update thread of the window.
-        """
-        static = self.static_available
-        if not static:
-            new_id = str(uuid4())
-            self.static_builds[new_id] = RenderMesh()
-            self.build_static(new_id)
-            self.touch(new_id)
+        This function is to be called in the update thread of the window,
+        which has a shared GL context, so the upload happens there too.
+        Pass upload=False if no GL context is current, draw() uploads instead.
+        With a perf_counter() `deadline`, only part of the changed meshes is handled
+        and the rest is left for the next update. Returns whether changes are left.
+        """
+        # Stay within the memory budget, bringing back what came into view
+        if self.memory is not None:
+            self.memory.enforce()
+        wanted = set(self.wanted)
+        self.wanted.difference_update(wanted)
+        for id in wanted:
+            self.require(id)
+        
+        # Take the ids out of the sets without losing concurrent changes
+        dirty = set(self.dirty)
+        self.dirty.difference_update(dirty)
+        if deadline is not None and dirty:
+            dirty = self.take_slice(dirty, deadline)
+        removed = set(self.removed)
+        self.removed.difference_update(removed)
+        toggled = set(self.toggled)
+        self.toggled.difference_update(toggled)
+        evicting = set(self.evicting) - dirty
+        self.evicting.difference_update(evicting)
+        
+        # Anything written again is resident again
+        for id in dirty:
+            self.evicted_gpu.discard(id)
+            self.evicted_cpu.discard(id)
+            self.loading.discard(id)
+        
+        start = time.perf_counter()
+        if self.batch is not None:
+            self.dirty |= self.batch.update(self.meshes, dirty, removed, toggled, self.hidden, evicting)
         else:
-            self.build_static(static[0])
-            self.touch(static[0])
+            self.update_static(dirty, removed | evicting, toggled, upload)
+        
+        # Keep a running estimate of the throughput
+        elapsed = time.perf_counter() - start
+        meshes = [self.meshes.get(id) for id in dirty] # Meshes may be deleted meanwhile
+        vertices = sum(len(mesh.data) for mesh in meshes if mesh is not None)
+        if vertices and elapsed > 0:
+            self.rate = self.rate * 0.8 + vertices / elapsed * 0.2
+        
+        for id in dirty:
+            mesh = self.meshes.get(id)
+            if mesh is None:
+                continue
+            mesh.notify_update()
+            if self.memory is not None:
+                self.memory.set_usage(id, cpu=mesh.cpu_bytes, gpu=self.gpu_bytes(id))
+                self.memory.mark(id)
+        return bool(self.dirty)
+                
+    def gpu_bytes(self, id) -> int:
+        """
+        Bytes a mesh takes up on the GPU, counting every static build it is copied into
+        """
+        if self.batch is not None:
+            return self.batch.gpu_bytes(id)
+        size = 0
+        if id in self.arena.slots:
+            size += self.arena.slots[id][1] * self.layout.stride
+        if id in self.index_arena.slots:
+            size += self.index_arena.slots[id][1] * 4
+        return size * len(self.snapshots.builds)
+                
+    def update_static(self, dirty, removed, toggled, upload) -> None:
+        """
+        Bring the back static build up to date and publish it
+        """
+        # Release the slots of deleted meshes.
+        # Stale vertex slots are never indexed again, so only index slots need clearing.
+        clears = []
+        for id in removed:
+            self.arena.release(id)
+            slot = self.index_arena.release(id)
+            if slot is not None:
+                clears.append(slot)
+        
+        # Make sure every changed mesh still fits in its slots
+        for id in dirty:
+            mesh = self.meshes.get(id)
+            if mesh is None:
+                continue
+            self.arena.fit(id, len(mesh.data))
+            old = self.index_arena.fit(id, mesh.index_count)
+            if old is not None:
+                clears.append(old)
         
-        if len(static) > 1:
-            removed = static.pop(-1)
-            self.static_builds[removed].dispose()
-            del self.static_builds[removed]
+        # Every static build has to pick up these changes eventually,
+        # hiding or showing a mesh just rewrites its index slot
+        changed = dirty | toggled
+        for build in self.snapshots.builds:
+            build.pending |= changed
+            build.clears += clears
         
-        for mesh in self.meshes:
-            self.meshes[mesh].notify_update()
+        # Bring the back build up to date and hand it to the renderer
+        if changed or clears or not self.snapshots.version:
+            self.build_static(self.snapshots.back)
+            if upload:
+                self.snapshots.back.upload()
+            self.snapshots.publish(uploaded=upload)
         
-    def build_static(self, id: str) -> None:
+    @PROFILER.profiled("UnifiedMesh.build_static")
+    def build_static(self, static: RenderMesh) -> None:
         """
-        Combine all the mesh data into a single 1d numpy array
+        Copy the slots of the meshes which changed since this build was last updated.
+        The cost scales with the number of changed meshes, not the total.
         """
-        # Init empty arrays
-        vertices = []
-        colors = []
+        static.lock.acquire()
+        if not static.version:
+            static.pending = set(self.arena.slots) # Never built, copy everything
+        
+        # Grow the arrays if the arenas outgrew them, keeping the old contents
+        if len(static.data) < self.arena.capacity:
+            data = self.layout.allocate(self.arena.capacity)
+            data[:len(static.data)] = static.data
+            static.data = data
+            static.mark_dirty()
+        if len(static.indices) < self.index_arena.capacity:
+            indices = np.zeros(self.index_arena.capacity, dtype=np.uint32)
+            indices[:len(static.indices)] = static.indices
+            static.indices = indices
+            static.mark_dirty(indices=True)
+        
+        # Zero out freed index slots first, a dirty mesh might have moved into one.
+        # All-zero indices make degenerate triangles, which draw nothing.
+        for offset, capacity in static.clears:
+            static.indices[offset:offset + capacity] = 0
+            static.mark_dirty(offset, offset + capacity, indices=True)
         
-        # Update the arrays
-        for mesh in self.meshes:
+        # Copy the dirty slots, rebasing the indices onto the vertex slot
+        deferred = set()
+        for mesh_id in static.pending:
+            mesh = self.meshes.get(mesh_id)
+            slot = self.arena.slots.get(mesh_id)
+            index_slot = self.index_arena.slots.get(mesh_id)
+            if mesh is None or slot is None or index_slot is None:
+                continue
+            offset, capacity = slot
+            index_offset, index_capacity = index_slot
+            if mesh_id in self.hidden:
+                static.indices[index_offset:index_offset + index_capacity] = 0
+                static.mark_dirty(index_offset, index_offset + index_capacity, indices=True)
+                continue
             mesh.lock.acquire()
-            vertices += [mesh.vertices]
-            colors += [mesh.colors]
+            
+            # Deleted by the main thread since it was looked up
+            if mesh.disposed or self.meshes.get(mesh_id) is not mesh:
+                mesh.lock.release()
+                continue
+            
+            # The mesh grew after its slots were fitted, pick it up next update
+            if len(mesh.data) > capacity or mesh.index_count > index_capacity:
+                mesh.lock.release()
+                deferred.add(mesh_id)
+                continue
+            
+            length = len(mesh.data)
+            static.data[offset:offset + length] = mesh.data
+            static.mark_dirty(offset, offset + length)
+            static.mark_dirty(index_offset, index_offset + index_capacity, indices=True)
+            indices = static.indices[index_offset:index_offset + index_capacity]
+            if mesh.indices is None:
+                indices[:length] = np.arange(offset, offset + length, dtype=np.uint32)
+                indices[length:] = 0
+            else:
+                np.add(mesh.indices, offset, out=indices[:len(mesh.indices)], casting="unsafe")
+                indices[len(mesh.indices):] = 0
             mesh.lock.release()
-        static_vertices = np.concatenate(vertices, None)
-        static_colors = np.concatenate(colors, None)
         
-        # Assign the arrays to the actual mesh
-        static = self.static_builds[id]
-        static.lock.acquire()
-        del static.vertices
-        del static.colors
-        static.vertices = static_vertices
-        static.colors = static_colors
+        static.pending = deferred
+        static.clears = []
+        static.count = self.index_arena.end
         static.lock.release()
+        self.dirty |= deferred
         
     def draw(self) -> None:
         """
-        Draws the latest mesh which is not busy
+        Draws the latest published snapshot, or the multi-draw batch
         """ 
-        if not self.static_drawable:
-            return # Prevent the screen from going blank
+        static = None
+        if self.batch is None:
+            static = self.snapshots.acquire()
+            if static is None:
+                return # Prevent the screen from going blank
+            
+            # Upload the snapshot if the update thread did not do it already
+            if static.uploaded != static.version:
+                static.upload()
+                static.uploaded = static.version
         
         glClear(GL_COLOR_BUFFER_BIT)
         glClear(GL_DEPTH_BUFFER_BIT)
         
-        glEnableClientState(GL_VERTEX_ARRAY)
-        glEnableClientState(GL_COLOR_ARRAY)
+        self.layout.enable()
         glEnable(GL_DEPTH_TEST)
         glDepthMask(GL_TRUE)
         glDepthFunc(GL_LEQUAL)
-        glDepthRange(0,0, 1.0)
+        glDepthRange(0.0, 1.0)
         
-        self.static_builds[self.static_drawable].draw()
+        if static is not None:
+            static.draw()
+
+            # Static builds are drawn whole, so every shown mesh is in use and wanted back if evicted
+            if self.memory is not None:
+                evicted = set(self.evicted_gpu)
+                shown = [id for id in self.meshes if id not in self.hidden]
+                self.memory.touch([id for id in shown if id not in evicted])
+                self.wanted.update(id for id in shown if id in evicted)
+        else:
+            self.batch.draw(Frustum.from_gl() if self.culling else None)
+            if self.memory is not None:
+                self.memory.touch(self.batch.drawn_ids)
+            self.wanted.update(self.batch.wanted_ids)
         
-        glDisableClientState(GL_VERTEX_ARRAY)
-        glDisableClientState(GL_COLOR_ARRAY)
+        self.layout.disable()
         glDisable(GL_DEPTH_TEST)
 
     @property
@@ -243,31 +1538,16 @@ class UnifiedMesh:
         """
         Return whether any mesh in the list was updated
         """
-        return any([self.meshes[mesh].changed for mesh in self.meshes])
-
-    @property
-    def static_available(self) -> bool | list:
-        """
-        Return whether any mesh in the static build list is not currently drawing/modifying
-        """
-        if any([self.static_builds[mesh].lock.locked() for mesh in self.static_builds]):
-            return False
-        ret = []
-        for mesh in self.sorted_ids:
-            if not self.static_builds[mesh].lock.locked(): ret.append(mesh)
-        return ret
+        return bool(self.dirty)
     
     @property
-    def static_drawable(self) -> str | None:
-        """
-        Return whether any mesh in the static build list is not currently drawing/modifying
-        """
-        for mesh in self.sorted_ids:
-            if not self.static_builds[mesh].lock.locked(): return mesh
-    
-    def touch(self, id) -> None:
+    def needs_redraw(self) -> bool:
         """
-        Move id to the first element in self.sorted_ids
+        Whether drawing again would show anything new: changes waiting for an update,
+        or a build which was published but not drawn yet
         """
-        self.sorted_ids.remove(id)
-        self.sorted_ids = [id] + self.sorted_ids
+        if self.dirty or self.removed or self.toggled or self.wanted:
+            return True
+        if self.batch is not None:
+            return self.batch.published is not self.batch.current
+        return self.snapshots.fresh
@@ -0,0 +1,268 @@
+# Imports
+import os
+import json
+import lzma
+import zlib
+import struct
+import numpy as np
+
+from core.mesh import Mesh, DEFAULT_LAYOUT
+
+# Default constants
+MESH_MAGIC = b"LHMESHES"
+MESH_FORMAT = 1 # Bump when the container layout changes
+SECTION_ALIGNMENT = 64 # Payloads start at multiples of this, so mapped arrays are aligned
+FOOTER = struct.Struct("<QQ8s") # Table offset, table length, magic
+
+# Optional per-section compression, name -> (compress(bytes, level), decompress(bytes))
+COMPRESSORS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+def layout_descr(dtype) -> list:
+    """
+    The dtype description of a layout as it reads back from the JSON table
+    """
+    return json.loads(json.dumps(np.dtype(dtype).descr))
+
+class MeshWriter:
+    """
+    Streaming writer of the mesh container.
+    The file is the magic and format version, the aligned array sections one after the other,
+    then a JSON table of the meshes and a footer pointing at it. Nothing is written twice
+    and the writer never seeks, so it also works on pipes and sockets.
+    A path is written next to its final place and renamed on close(), so a container which
+    is still mapped by a MeshFile is never truncated under it.
+    """
+
+    def __init__(self, file, compression=None, level=6) -> None:
+        """
+        Start a container in a path or a binary file object.
+        `compression` is the default for every section, None or a key of COMPRESSORS.
+        """
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError(f'[core/MeshWriter] Unknown compression {compression}!')
+        self.owned = isinstance(file, (str, bytes)) or hasattr(file, "__fspath__")
+        self.path = os.fsdecode(file) if self.owned else None
+        self.temporary = f"{self.path}.{os.getpid()}.tmp" if self.owned else None
+        self.file = open(self.temporary, "wb") if self.owned else file
+        self.compression = compression
+        self.level = level
+        self.position = 0
+        self.entries = []
+        self.ids = set()
+        self.closed = False
+
+        self.write_bytes(MESH_MAGIC + struct.pack("<I", MESH_FORMAT))
+
+    def __enter__(self) -> "MeshWriter":
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        if error_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_bytes(self, data) -> None:
+        """
+        Append raw bytes and keep track of the position
+        """
+        self.file.write(data)
+        self.position += memoryview(data).nbytes
+
+    def pad(self) -> None:
+        """
+        Pad the file up to the section alignment
+        """
+        padding = -self.position % SECTION_ALIGNMENT
+        if padding:
+            self.write_bytes(bytes(padding))
+
+    def section(self, array, compression) -> dict:
+        """
+        Write an array as an aligned section and return its table entry
+        """
+        self.pad()
+        raw = np.ascontiguousarray(array).view(np.uint8)
+        entry = {"offset": self.position, "size": raw.nbytes, "raw_size": raw.nbytes, "compression": compression}
+        if compression is not None:
+            payload = COMPRESSORS[compression][0](raw.tobytes(), self.level)
+            entry["size"] = len(payload)
+            self.write_bytes(payload)
+        else:
+            self.write_bytes(raw)
+        return entry
+
+    def write_arrays(self, id, data, indices=None, bounds=None, compression=False) -> None:
+        """
+        Append a mesh given as its vertex array, optional uint32 indices and
+        optional (min, max, center, radius) bounds.
+        compression=False uses the default of the writer.
+        """
+        if self.closed:
+            raise ValueError('[core/MeshWriter] The container is already closed!')
+        if id in self.ids:
+            raise ValueError(f'[core/MeshWriter] Mesh {id} is already in the container!')
+        if compression is False:
+            compression = self.compression
+        elif compression is not None and compression not in COMPRESSORS:
+            raise ValueError(f'[core/MeshWriter] Unknown compression {compression}!')
+
+        entry = {
+            "id": id,
+            "dtype": layout_descr(data.dtype),
+            "count": len(data),
+            "index_count": None if indices is None else len(indices),
+            "bounds": None,
+            "data": self.section(data, compression),
+            "indices": None,
+        }
+        if indices is not None:
+            entry["indices"] = self.section(np.asarray(indices, dtype=np.uint32), compression)
+        if bounds is not None:
+            low, high, center, radius = bounds
+            entry["bounds"] = [
+                np.asarray(low).tolist(),
+                np.asarray(high).tolist(),
+                np.asarray(center).tolist(),
+                float(radius),
+            ]
+        self.entries.append(entry)
+        self.ids.add(id)
+
+    def write(self, mesh, id=None, compression=False) -> None:
+        """
+        Append a Mesh, under its own id unless another one is given
+        """
+        mesh.lock.acquire()
+        try:
+            self.write_arrays(
+                id or mesh.id, mesh.data, mesh.indices,
+                (mesh.bounds_min, mesh.bounds_max, mesh.center, mesh.radius),
+                compression
+            )
+        finally:
+            mesh.lock.release()
+
+    def close(self, metadata=None) -> None:
+        """
+        Write the table and footer, `metadata` is any JSON-serializable value stored with it
+        """
+        if self.closed:
+            return
+        self.pad()
+        offset = self.position
+        table = json.dumps({"format": MESH_FORMAT, "meshes": self.entries, "metadata": metadata}).encode()
+        self.write_bytes(table)
+        self.write_bytes(FOOTER.pack(offset, len(table), MESH_MAGIC))
+        self.closed = True
+        if self.owned:
+            self.file.close()
+            os.replace(self.temporary, self.path)
+        else:
+            self.file.flush()
+
+    def abort(self) -> None:
+        """
+        Give up on the container, a path keeps its previous contents
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.owned:
+            self.file.close()
+            os.remove(self.temporary)
+
+class MeshFile:
+    """
+    Read side of the mesh container.
+    The file is mapped once, uncompressed sections are handed out as read-only views of the
+    mapping without copying, compressed ones are decompressed into fresh arrays.
+    Only the sections of the meshes actually asked for are touched.
+    """
+
+    def __init__(self, path) -> None:
+        """
+        Map a container and read its table
+        """
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(self.buffer) < len(MESH_MAGIC) + 4 + FOOTER.size or bytes(self.buffer[:len(MESH_MAGIC)]) != MESH_MAGIC:
+            raise ValueError(f'[core/MeshFile] {path} is not a mesh container!')
+        offset, length, magic = FOOTER.unpack(bytes(self.buffer[-FOOTER.size:]))
+        if magic != MESH_MAGIC:
+            raise ValueError(f'[core/MeshFile] {path} is truncated!')
+        table = json.loads(bytes(self.buffer[offset:offset + length]))
+        if table["format"] != MESH_FORMAT:
+            raise ValueError(f'[core/MeshFile] Unsupported container format {table["format"]}!')
+        self.metadata = table["metadata"]
+        self.entries = {entry["id"]: entry for entry in table["meshes"]}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, id) -> bool:
+        return id in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def ids(self) -> list:
+        """
+        Ids of the meshes in the container, in the order they were written
+        """
+        return list(self.entries)
+
+    def section(self, section, dtype) -> np.ndarray:
+        """
+        Array stored in a section of the file
+        """
+        start = section["offset"]
+        payload = self.buffer[start:start + section["size"]]
+        if section["compression"] is not None:
+            raw = COMPRESSORS[section["compression"]][1](payload.tobytes())
+            return np.frombuffer(bytearray(raw), dtype=dtype)
+        return payload.view(dtype)
+
+    def arrays(self, id, dtype=None) -> tuple:
+        """
+        Returns (data, indices, bounds) of a mesh, indices and bounds may be None.
+        `dtype` is checked against the stored vertex layout if given.
+        """
+        entry = self.entries[id]
+        stored = np.dtype([tuple(field[:2]) + tuple(tuple(shape) for shape in field[2:]) for field in entry["dtype"]])
+        if dtype is not None and layout_descr(dtype) != entry["dtype"]:
+            raise ValueError(f'[core/MeshFile] Mesh {id} was stored with a different vertex layout!')
+        data = self.section(entry["data"], stored)
+        indices = None if entry["indices"] is None else self.section(entry["indices"], np.uint32)
+        bounds = None
+        if entry["bounds"] is not None:
+            low, high, center, radius = entry["bounds"]
+            bounds = (
+                np.array(low, dtype=np.float32),
+                np.array(high, dtype=np.float32),
+                np.array(center, dtype=np.float32),
+                radius,
+            )
+        return data, indices, bounds
+
+    def load(self, id, mesh) -> None:
+        """
+        Fill an existing mesh, mapped sections are wrapped without copying
+        """
+        data, indices, bounds = self.arrays(id, mesh.layout.dtype)
+        mesh.adopt(data, indices, bounds)
+
+    def meshes(self, ids=None, layout=DEFAULT_LAYOUT) -> dict:
+        """
+        Create standalone meshes for the given ids, or all of them
+        """
+        meshes = {}
+        for id in self.entries if ids is None else ids:
+            mesh = Mesh(id, layout=layout, count=0)
+            self.load(id, mesh)
+            meshes[id] = mesh
+        return meshes
@@ -0,0 +1,279 @@
+# Imports
+import timeit
+import functools
+import numpy as np
+
+# Default constants
+NOISE_OCTAVES = 4
+LACUNARITY = 2.0 # Frequency multiplier between two octaves
+GAIN = 0.5 # Amplitude multiplier between two octaves
+HEIGHT_SCALE = 16 # Terrain heights are the 4 octave fBm times this
+TEXTURE_SCALE = 1 / 64 # Frequency of the color noise, in world units
+HEIGHT_SEED = 64 # The seeds the old terrain generation used
+TEXTURE_SEED = 32786
+
+# Simplex noise in 3D, after Stefan Gustavson's reference implementation
+SKEW = 1 / 3
+UNSKEW = 1 / 6
+SCALE = 32 # Brings the sum of the corner contributions to about [-1, 1]
+GRADIENTS = np.array([
+    (1, 1, 0), (-1, 1, 0), (1, -1, 0), (-1, -1, 0),
+    (1, 0, 1), (-1, 0, 1), (1, 0, -1), (-1, 0, -1),
+    (0, 1, 1), (0, -1, 1), (0, 1, -1), (0, -1, -1),
+], dtype=np.float64)
+
+def shuffle(seed) -> np.ndarray:
+    """
+    A permutation of 0-255 from a seed, with a splitmix64 driven Fisher-Yates shuffle.
+    It is written out instead of using np.random, so the tables never change between
+    NumPy versions, platforms or processes.
+    """
+    state = seed & 0xFFFFFFFFFFFFFFFF
+    values = list(range(256))
+    for index in range(255, 0, -1):
+        state = (state + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        mixed = ((state ^ (state >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        mixed = ((mixed ^ (mixed >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        other = (mixed ^ (mixed >> 31)) % (index + 1)
+        values[index], values[other] = values[other], values[index]
+    return np.array(values, dtype=np.intp)
+
+class Noise:
+    """
+    Simplex, fBm and ridged noise over whole (n, 3) point arrays at once.
+    The permutation and gradient tables are built once per seed, and the temporaries live in
+    scratch buffers which only grow, so evaluating chunk after chunk allocates next to nothing.
+    Only additions, multiplications and floor are used, so a seed gives bit-identical values
+    in every process. An instance is not thread-safe because of the scratch buffers,
+    use one per thread or process.
+    """
+
+    def __init__(self, seed=0) -> None:
+        """
+        Build the tables of a seed
+        """
+        self.seed = seed
+        perm = shuffle(seed)
+        self.perm = np.concatenate((perm, perm)) # Doubled, so the hash never needs a modulo
+        gradients = GRADIENTS[self.perm % 12] # Folds the last permutation lookup into the gradients
+        self.gradients = [np.ascontiguousarray(gradients[:, axis]) for axis in range(3)]
+        self.capacity = 0
+        self.scratch = {}
+
+    def buffers(self, count) -> dict:
+        """
+        Views of the scratch buffers for `count` points, growing them if needed.
+        Coordinates are stored as (3, n) rows, so every component is contiguous.
+        """
+        if count > self.capacity:
+            self.capacity = max(count, self.capacity * 2)
+            size = self.capacity
+            self.scratch = {
+                "points": np.empty((3, size), dtype=np.float64), # Input of simplex()
+                "scaled": np.empty((3, size), dtype=np.float64), # Octave coordinates in fbm()
+                "octave": np.empty(size, dtype=np.float64), # Octave values in fbm()
+                "cell": np.empty((3, size), dtype=np.float64),
+                "offset": np.empty((3, size), dtype=np.float64),
+                "corner": np.empty((3, size), dtype=np.float64),
+                "compare": np.empty((3, size), dtype=bool),
+                "first": np.empty((3, size), dtype=bool),
+                "second": np.empty((3, size), dtype=bool),
+                "index": np.empty((3, size), dtype=np.intp),
+                "hash": np.empty(size, dtype=np.intp),
+                "weight": np.empty(size, dtype=np.float64),
+                "dot": np.empty(size, dtype=np.float64),
+                "term": np.empty(size, dtype=np.float64),
+            }
+        return {name: buffer[..., :count] for name, buffer in self.scratch.items()}
+
+    def rows(self, points) -> np.ndarray:
+        """
+        Copy (n, 3) points into the (3, n) input scratch buffer
+        """
+        points = np.asarray(points).reshape(-1, 3)
+        rows = self.buffers(len(points))["points"]
+        np.copyto(rows, points.T)
+        return rows
+
+    def evaluate(self, rows, out) -> np.ndarray:
+        """
+        Simplex noise of (3, n) coordinate rows into a float64 array of length n
+        """
+        scratch = self.buffers(rows.shape[1])
+        cell, offset, corner = scratch["cell"], scratch["offset"], scratch["corner"]
+        first, second, index = scratch["first"], scratch["second"], scratch["index"]
+        hash, weight, dot, term = scratch["hash"], scratch["weight"], scratch["dot"], scratch["term"]
+        perm = self.perm
+
+        # Skew the space to find the simplex cell, and the offset from its origin
+        np.add(rows[0], rows[1], out=weight)
+        weight += rows[2]
+        weight *= SKEW
+        np.add(rows, weight, out=cell)
+        np.floor(cell, out=cell)
+        np.add(cell[0], cell[1], out=weight)
+        weight += cell[2]
+        weight *= UNSKEW
+        np.subtract(rows, cell, out=offset)
+        offset += weight
+        np.copyto(index, cell, casting="unsafe")
+        index &= 255
+
+        # Rank the offsets to find which corners the simplex goes through after the origin
+        x, y, z = offset
+        a, b, c = scratch["compare"]
+        np.greater_equal(x, y, out=a)
+        np.greater_equal(x, z, out=b)
+        np.greater_equal(y, z, out=c)
+        np.logical_and(a, b, out=first[0])
+        np.logical_or(a, b, out=second[0])
+        np.greater(c, a, out=first[1]) # c and not a
+        np.greater_equal(c, a, out=second[1]) # c or not a
+        np.logical_or(b, c, out=first[2])
+        np.logical_not(first[2], out=first[2])
+        np.logical_and(b, c, out=second[2])
+        np.logical_not(second[2], out=second[2])
+
+        # Sum the contributions of the four corners
+        out[:] = 0
+        for corner_index, step in enumerate((0, first, second, 1)):
+            np.subtract(offset, step, out=corner)
+            corner += corner_index * UNSKEW
+
+            # Hash the corner to a gradient, the doubled table keeps the sums in range
+            steps = (step,) * 3 if isinstance(step, int) else step
+            np.add(index[2], steps[2], out=hash)
+            np.take(perm, hash, out=hash)
+            hash += index[1]
+            hash += steps[1]
+            np.take(perm, hash, out=hash)
+            hash += index[0]
+            hash += steps[0]
+            np.take(self.gradients[0], hash, out=dot)
+            dot *= corner[0]
+            for axis in (1, 2):
+                np.take(self.gradients[axis], hash, out=term)
+                term *= corner[axis]
+                dot += term
+
+            # Falloff (0.6 - r^2)^4, zero outside the radius of the corner
+            np.multiply(corner[0], corner[0], out=weight)
+            for axis in (1, 2):
+                np.multiply(corner[axis], corner[axis], out=term)
+                weight += term
+            np.subtract(0.6, weight, out=weight)
+            np.maximum(weight, 0.0, out=weight)
+            weight *= weight
+            weight *= weight
+            weight *= dot
+            out += weight
+        out *= SCALE
+        return out
+
+    def result(self, values, out) -> np.ndarray:
+        """
+        Copy float64 results into `out` if one was given, converting its dtype
+        """
+        if out is None:
+            return values
+        np.copyto(out.reshape(-1), values, casting="unsafe")
+        return out
+
+    def simplex(self, points, out=None) -> np.ndarray:
+        """
+        Simplex noise in about [-1, 1] at every point of an (n, 3) array
+        """
+        rows = self.rows(points)
+        return self.result(self.evaluate(rows, np.empty(rows.shape[1], dtype=np.float64)), out)
+
+    def octaves(self, points, octaves, lacunarity, gain) -> np.ndarray:
+        """
+        Sum the octaves of fBm into a new float64 array
+        """
+        rows = self.rows(points)
+        scratch = self.buffers(rows.shape[1])
+        scaled, octave = scratch["scaled"], scratch["octave"]
+        total = np.zeros(rows.shape[1], dtype=np.float64)
+        frequency, amplitude = 1.0, 1.0
+        for _ in range(octaves):
+            np.multiply(rows, frequency, out=scaled)
+            self.evaluate(scaled, octave)
+            octave *= amplitude
+            total += octave
+            frequency *= lacunarity
+            amplitude *= gain
+        return total
+
+    def fbm(self, points, octaves=NOISE_OCTAVES, lacunarity=LACUNARITY, gain=GAIN, out=None) -> np.ndarray:
+        """
+        Fractal Brownian motion: octaves of simplex noise, each at `lacunarity` times the
+        frequency and `gain` times the amplitude of the last one, like the old fractal_noise()
+        """
+        return self.result(self.octaves(points, octaves, lacunarity, gain), out)
+
+    def ridged(self, points, octaves=NOISE_OCTAVES, lacunarity=LACUNARITY, gain=GAIN, out=None) -> np.ndarray:
+        """
+        Ridged noise, 1 - |fbm|, sharp crests where the fBm crosses zero, like the old fractal_ridge_noise()
+        """
+        values = self.octaves(points, octaves, lacunarity, gain)
+        np.abs(values, out=values)
+        np.subtract(1.0, values, out=values)
+        return self.result(values, out)
+
+@functools.lru_cache(maxsize=None)
+def get_noise(seed) -> Noise:
+    """
+    The shared Noise of a seed, so the tables are only built once per process.
+    Like Noise itself, only use it from one thread at a time.
+    """
+    return Noise(seed)
+
+def displace(positions, center=(0, 0, 0), radius=1.0, height_scale=HEIGHT_SCALE, seed=HEIGHT_SEED, octaves=NOISE_OCTAVES) -> tuple:
+    """
+    Project chunk vertices onto a planet and push them out by fBm terrain heights.
+    The noise is sampled on the unit sphere, so neighbouring chunks always agree on their edges.
+    Returns the float32 (n, 3) positions and float64 heights.
+    """
+    positions = np.asarray(positions).reshape(-1, 3)
+    center = np.asarray(center, dtype=np.float64)
+    directions = positions - center
+    directions /= np.sqrt(np.einsum("ij,ij->i", directions, directions))[:, None]
+    heights = get_noise(seed).fbm(directions, octaves)
+    heights *= height_scale
+    return (center + directions * (radius + heights)[:, None]).astype(np.float32), heights
+
+def shade(positions, heights, base=(0.1, 0.1, 0.1), height_scale=HEIGHT_SCALE, texture_scale=TEXTURE_SCALE, seed=TEXTURE_SEED, octaves=NOISE_OCTAVES) -> np.ndarray:
+    """
+    Float RGB vertex colors from ridged noise over the surface and the terrain heights,
+    the same mix as the old terrain generation
+    """
+    texture = get_noise(seed).ridged(np.asarray(positions).reshape(-1, 3) * texture_scale, octaves)
+    texture *= 0.5
+    texture -= np.asarray(heights) / (2 * height_scale)
+    colors = np.empty((len(texture), 3), dtype=np.float32)
+    colors[:] = np.asarray(base, dtype=np.float32) + 0.25
+    colors += (texture * 0.5)[:, None]
+    return colors
+
+def benchmark(segments=128, number=20) -> dict:
+    """
+    Time terrain displacement and coloring of one tesselated chunk in milliseconds
+    """
+    from core.tesselator import tesselate
+    quad = np.array([(1, 1, -1), (1, 1, 1), (-1, 1, 1), (-1, 1, -1)], dtype=np.float32) * 1024
+    grid = tesselate(quad, segments)
+    positions, heights = displace(grid, radius=1024)
+    shade(positions, heights)
+    return {
+        "segments": segments,
+        "vertices": len(grid),
+        "displace": timeit.timeit(lambda: displace(grid, radius=1024), number=number) / number * 1000,
+        "shade": timeit.timeit(lambda: shade(positions, heights), number=number) / number * 1000,
+    }
+
+if __name__ == "__main__":
+    results = benchmark()
+    print(
+        f"segments={results['segments']}: {results['vertices']} vertices, "
+        f"displace {results['displace']:.2f} ms, shade {results['shade']:.2f} ms per chunk"
+    )
@@ -1,46 +1,195 @@
 # Imports
+import os
+import time
 from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from core.profiler import PROFILER
+
+# Default constants
+MAX_DEFER = 30 # Frames a deferrable task may be put off before it runs regardless of the budget
 
 class Scheduler:
     """
     Maintains a list of objects to be scheduled along with the function name.
+    Items run by priority, each at its own frequency, within an optional per-frame time budget.
+    Every frame the due items form a dependency graph: items which need the GL context run on
+    the thread calling process(), the others on a thread pool as soon as their dependencies are done.
     """
-    
-    def __init__(self) -> None:
+
+    def __init__(self, budget=None, max_defer=MAX_DEFER, workers=None) -> None:
         """
-        Initialize the scheduler and required variables
+        Initialize the scheduler and required variables.
+        `budget` is the time in seconds process() may spend per frame, None for no limit.
+        `workers` is the size of the thread pool, by default one per core.
+        The pool is only started once an item without GL is added.
         """
         self.queue = {}
-        
-    def add(self, obj, function_name, id=str(uuid4())) -> str:
+        self.budget = budget
+        self.max_defer = max_defer
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+
+        # Frame bookkeeping
+        self.frame = 0
+        self.deferred = [] # Ids put off in the last frame
+        self.elapsed = 0.0 # Seconds spent in the last frame
+
+    def add(self, obj, function_name, id=None, priority=0, every=1, interval=0.0, deferrable=False, budgeted=False, after=(), gl=True, args=False) -> str:
         """
-        Adds an object to the queue, returns the id of that object in the queue
+        Adds an object to the queue, returns the id of that object in the queue.
+        - Higher `priority` items run first.
+        - The item runs at most once every `every` frames and `interval` seconds.
+        - `deferrable` items are put off to a later frame once the budget is used up.
+        - `budgeted` items are deferrable and time-sliced: the function is called with the
+          perf_counter() deadline of the frame (None without a budget) and returns
+          whether it has work left, in which case it runs again next frame.
+        - The item runs after the items in `after` which run in the same frame.
+        - Items with `gl=False` don't touch the GL context and run on the thread pool.
+        - Items with `args=True` get the arguments given to process(), e.g. the timestep
+          or interpolation alpha of the window, before the deadline of budgeted items.
         """
+        id = id or str(uuid4())
+        if not gl and self.pool is None:
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="scheduler")
         self.queue[id] = {
             "object": obj,
-            "function": function_name
+            "function": function_name,
+            "callable": getattr(obj, function_name), # Bound once instead of looked up every frame
+            "name": f"{type(obj).__name__}.{function_name}", # For the profiler
+            "after": tuple(after),
+            "gl": gl,
+            "priority": priority,
+            "every": every,
+            "interval": interval,
+            "deferrable": deferrable or budgeted,
+            "budgeted": budgeted,
+            "args": args,
+            "last_frame": None,
+            "last_time": None,
+            "pending": False, # Budgeted work left over from the last run
+            "deferred": 0, # Frames put off in a row
         }
         return id
-        
+
     def remove(self, id) -> str:
         """
         Removes an object from the queue by its id
         """
         del self.queue[id]
         return id
-    
-    def process_item(self, id) -> str:
+
+    def due(self, item, now) -> bool:
+        """
+        Whether an item should run in the current frame
+        """
+        if item["pending"] or item["deferred"] or item["last_frame"] is None:
+            return True
+        return (
+            self.frame - item["last_frame"] >= item["every"]
+            and now - item["last_time"] >= item["interval"]
+        )
+
+    def process_item(self, id, deadline=None, args=()) -> str:
         """
         Process a single item in the queue.
         Useful if you want to partially update the queue
         """
         item = self.queue[id]
-        item['object'].__getattribute__(item['function'])()
+        function = item["callable"]
+        args = args if item["args"] else ()
+        start = time.perf_counter()
+        if item["budgeted"]:
+            item["pending"] = bool(function(*args, deadline))
+        else:
+            function(*args)
+        end = time.perf_counter()
+        if PROFILER.enabled:
+            PROFILER.record(item["name"], start, end)
+        item["last_frame"] = self.frame
+        item["last_time"] = end
+        item["deferred"] = 0
         return id
-    
-    def process(self) -> None:
+
+    def process(self, *args) -> list:
+        """
+        Process the queue, i.e. call the asked for functions of the due queue items.
+        `args` are passed on to the items added with args=True.
+        Returns the ids of the items deferred to a later frame, also kept in self.deferred.
+        """
+        start = time.perf_counter()
+        deadline = None if self.budget is None else start + self.budget
+        self.frame += 1
+
+        # Items may be added from other threads, older and long deferred items win ties
+        items = {id: item for id, item in list(self.queue.items()) if self.due(item, start)}
+        order = sorted(items, key=lambda id: -(items[id]["priority"] + items[id]["deferred"]))
+
+        # Only dependencies running in this frame are waited for
+        waiting = {id: {dep for dep in items[id]["after"] if dep in items} for id in order}
+        dependents = {id: [] for id in order}
+        for id in order:
+            for dep in waiting[id]:
+                dependents[dep].append(id)
+
+        deferred = []
+        ready = [id for id in order if not waiting[id]]
+        running = {} # future -> id
+        done = []
+
+        def finish(id, ran=True) -> None:
+            done.append(id)
+            if ran and items[id]["pending"]:
+                deferred.append(id)
+            for dependent in dependents[id]:
+                waiting[dependent].discard(id)
+                if not waiting[dependent]:
+                    ready.append(dependent)
+
+        while ready or running:
+            # Pick up pool items which finished meanwhile, raising their errors here
+            for future in [future for future in running if future.done()]:
+                future.result()
+                finish(running.pop(future))
+
+            # Hand ready pool items to the pool, up to the next GL item
+            ready.sort(key=order.index)
+            current = None
+            while ready and current is None:
+                id = ready.pop(0)
+                item = items[id]
+                if id not in self.queue:
+                    finish(id, False) # Removed meanwhile
+                elif item["deferrable"] and item["deferred"] < self.max_defer and deadline is not None and time.perf_counter() >= deadline:
+                    # Dependents of a deferred item still run, on what it left last time
+                    item["deferred"] += 1
+                    deferred.append(id)
+                    finish(id, False)
+                elif not item["gl"]:
+                    running[self.pool.submit(self.process_item, id, deadline, args)] = id
+                else:
+                    current = id
+
+            if current is not None:
+                self.process_item(current, deadline, args)
+                finish(current)
+            elif running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    finish(running.pop(future))
+
+        if len(done) < len(order):
+            raise Exception('[core/Scheduler] Dependency cycle between ' + ", ".join(id for id in order if id not in done))
+
+        self.deferred = deferred
+        self.elapsed = time.perf_counter() - start
+        return deferred
+
+    def shutdown(self) -> None:
         """
-        Process the queue, i.e. call the asked for functions of the queue items
+        Wait for the thread pool and stop it
         """
-        for item in self.queue:
-            self.process_item(item)
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,206 @@
+# Imports
+import json
+import time
+import threading
+import itertools
+import functools
+import numpy as np
+
+# Default constants
+PROFILER_CAPACITY = 1 << 16 # Spans kept, the oldest are overwritten
+
+class Span:
+    """
+    Context manager recording the time spent in its block
+    """
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.profiler.record(self.name, self.start, time.perf_counter())
+
+class NullSpan:
+    """
+    Stands in for a Span while the profiler is disabled
+    """
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Profiler:
+    """
+    Records named begin/end timestamps into preallocated ring buffers.
+    Recording is a few array stores, and nothing at all while disabled,
+    so it can stay compiled into the hot paths and be toggled at runtime.
+    """
+
+    def __init__(self, capacity=PROFILER_CAPACITY, enabled=False) -> None:
+        """
+        Allocate the ring buffers
+        """
+        self.capacity = capacity
+        self.enabled = enabled
+        self.starts = np.zeros(capacity, dtype=np.float64)
+        self.ends = np.zeros(capacity, dtype=np.float64)
+        self.names = np.zeros(capacity, dtype=np.int32)
+        self.threads = np.zeros(capacity, dtype=np.int32)
+        self.counter = itertools.count() # next() is atomic, so threads never get the same slot
+        self.count = 0
+
+        # Interned names and threads, the buffers only hold their indices
+        self.lock = threading.Lock()
+        self.name_ids = {}
+        self.name_list = []
+        self.thread_ids = {}
+        self.thread_names = []
+        self.origin = time.perf_counter()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def toggle(self) -> bool:
+        """
+        Switch recording on or off, returns whether it is now on
+        """
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def intern(self, table, values, key, value) -> int:
+        """
+        Index of a key in one of the intern tables, adding it if it is new
+        """
+        self.lock.acquire()
+        index = table.get(key)
+        if index is None:
+            index = len(values)
+            values.append(value)
+            table[key] = index
+        self.lock.release()
+        return index
+
+    def record(self, name, start, end) -> None:
+        """
+        Record a span given its perf_counter() timestamps
+        """
+        if not self.enabled:
+            return
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.intern(self.name_ids, self.name_list, name, name)
+        ident = threading.get_ident()
+        thread = self.thread_ids.get(ident)
+        if thread is None:
+            thread = self.intern(self.thread_ids, self.thread_names, ident, threading.current_thread().name)
+        slot = next(self.counter)
+        index = slot % self.capacity
+        self.starts[index] = start
+        self.ends[index] = end
+        self.names[index] = name_id
+        self.threads[index] = thread
+        if slot >= self.count:
+            self.count = slot + 1
+
+    def span(self, name) -> Span | NullSpan:
+        """
+        Context manager recording its block under a name
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def profiled(self, name=None):
+        """
+        Decorator recording every call of a function, under its qualified name by default
+        """
+        def decorator(function):
+            label = name or function.__qualname__
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(label, start, time.perf_counter())
+            return wrapper
+        return decorator
+
+    def clear(self) -> None:
+        """
+        Forget every recorded span
+        """
+        self.counter = itertools.count()
+        self.count = 0
+
+    def spans(self) -> tuple:
+        """
+        The recorded (starts, ends, names, threads) arrays, oldest first
+        """
+        count = min(self.count, self.capacity)
+        order = np.arange(self.count - count, self.count) % self.capacity
+        return self.starts[order], self.ends[order], self.names[order], self.threads[order]
+
+    def summary(self) -> dict:
+        """
+        Per-name statistics of the recorded spans in milliseconds: count, total, mean, p95 and max
+        """
+        starts, ends, names, _ = self.spans()
+        durations = (ends - starts) * 1000
+        summary = {}
+        for index in np.unique(names):
+            values = durations[names == index]
+            summary[self.name_list[index]] = {
+                "count": len(values),
+                "total": float(values.sum()),
+                "mean": float(values.mean()),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max()),
+            }
+        return summary
+
+    def table(self) -> str:
+        """
+        The summary as a text table, most total time first
+        """
+        summary = self.summary()
+        width = max([len(name) for name in summary] + [4])
+        lines = [f"{'Name':<{width}} {'Count':>8} {'Mean ms':>9} {'P95 ms':>9} {'Max ms':>9}"]
+        for name, stats in sorted(summary.items(), key=lambda entry: -entry[1]["total"]):
+            lines.append(f"{name:<{width}} {stats['count']:>8} {stats['mean']:>9.3f} {stats['p95']:>9.3f} {stats['max']:>9.3f}")
+        return "\n".join(lines)
+
+    def export_chrome(self, path) -> None:
+        """
+        Write the recorded spans as Chrome trace events, for chrome://tracing or Perfetto
+        """
+        starts, ends, names, threads = self.spans()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": thread, "args": {"name": name}}
+            for thread, name in enumerate(self.thread_names)
+        ]
+        starts = (starts - self.origin) * 1e6
+        durations = (ends - self.origin) * 1e6 - starts
+        for start, duration, name, thread in zip(starts.tolist(), durations.tolist(), names.tolist(), threads.tolist()):
+            events.append({"name": self.name_list[name], "ph": "X", "ts": start, "dur": duration, "pid": 0, "tid": thread})
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+PROFILER = Profiler()
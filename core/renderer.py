@@ -1,27 +1,91 @@
 # Imports
 from core.logger import logger
-from core.mesh import UnifiedMesh
+from core.mesh import UnifiedMesh, UPLOADS
+from core.mesh_file import MeshWriter, MeshFile
 
 class Renderer:
     """
     A class which handles everything rendering-related in the game.
     """
     
-    def __init__(self) -> None:
+    def __init__(self, multidraw=True, memory=None, gl=True) -> None:
         """
         Initialize the renderer.
+        Meshes are drawn with a frustum culled multi-draw batch unless `multidraw` is False,
+        in which case everything goes into static builds which are always drawn whole.
+        Pass gl=False if the update thread has no GL context (see Window.gl), meshes are then
+        built without being uploaded, always into static builds as the batch lives on the GPU.
         """
         logger.info('[core/Renderer] Initializing Renderer...')
+        self.gl = gl
         
         # Create the unified mesh
-        self.mesh = UnifiedMesh()
+        self.mesh = UnifiedMesh(multidraw=multidraw and gl, memory=memory)
         
         # Redirect functions
         self.new_mesh = self.mesh.new_mesh
         self.delete_mesh = self.mesh.delete_mesh
+        self.hide = self.mesh.hide
+        self.show = self.mesh.show
+        self.require = self.mesh.require
+    
+    def update(self, deadline=None) -> bool:
+        """
+        Rebuild and upload the meshes, runs in the update thread of the window.
+        With a deadline the work is time-sliced, returns whether changes are left.
+        """
+        return self.mesh.update(upload=self.gl, deadline=deadline)
     
     def draw(self) -> None:
         """
-        Draw all meshes
+        Draw all meshes, nothing without a GL context
         """
+        if not self.gl:
+            return
         self.mesh.draw()
+        UPLOADS.next_frame()
+    
+    def save(self, path, ids=None, compression=None) -> list:
+        """
+        Save the meshes (all of them by default) to a mesh container, returns the saved ids.
+        Meshes whose arrays are evicted have nothing to save and are skipped.
+        """
+        mesh = self.mesh
+        ids = [id for id in (mesh.meshes if ids is None else ids) if id not in mesh.evicted_cpu]
+        with MeshWriter(path, compression) as writer:
+            for id in ids:
+                writer.write(mesh.meshes[id])
+            writer.close({"hidden": [id for id in ids if id in mesh.hidden]})
+        logger.info(f'[core/Renderer] Saved {len(ids)} meshes to {path}')
+        return ids
+    
+    def load(self, path, ids=None) -> list:
+        """
+        Load meshes (all of them by default) from a mesh container, returns the loaded ids.
+        The meshes wrap the mapped file, and reload from it if their arrays are evicted.
+        """
+        file = MeshFile(path)
+        ids = file.ids if ids is None else list(ids)
+        hidden = set((file.metadata or {}).get("hidden", ()))
+        for id in ids:
+            if id not in self.mesh.meshes:
+                self.new_mesh(id, loader=lambda mesh: file.load(mesh.id, mesh))
+            file.load(id, self.mesh.meshes[id])
+            if id in hidden:
+                self.hide(id)
+        logger.info(f'[core/Renderer] Loaded {len(ids)} meshes from {path}')
+        return ids
+    
+    @property
+    def needs_redraw(self) -> bool:
+        """
+        Whether the scene changed since the last draw, see Window.add_damage_source()
+        """
+        return self.mesh.needs_redraw
+    
+    @property
+    def uploaded_bytes(self) -> int:
+        """
+        Bytes sent to the GPU during the last frame
+        """
+        return UPLOADS.last_frame
@@ -1,66 +1,281 @@
 # Imports
-import glfw
+import time
+import threading
 
 from core.logger import logger
+from core.backends import BACKENDS
+from core.profiler import PROFILER
+from core.frame_stats import FrameStats
 from core.object_scheduler import Scheduler
 
+# Default constants
+UPDATE_INTERVAL = 1 / 240 # Minimum time between two passes of the update thread
+TIMESTEP = 1 / 60 # Fixed simulation step
+MAX_STEPS = 5 # Steps per frame at most, the simulation slows down instead of spiraling
+TARGET_FPS = 60 # For the "fps" pacing mode
+SPIN_MARGIN = 0.002 # Seconds before a frame deadline where sleeping stops and spinning starts
+IDLE_TIMEOUT = 0.5 # Seconds between two damage checks of an idle window
+PACING_MODES = ("vsync", "fps", "damage", None)
+
 class Window:
     """
-    Window class for easy creation of GLFW windows
+    Window class for easy creation of GLFW windows.
+    The backend can also be headless (see core.backends), for benchmarks on machines without a display.
     """
-    
+
     def __init__(self, **kwargs) -> None:
         """
         Initialize the window and worker thread
         """
         logger.info('[core/Window] Initializing window...')
-        
-        # Throw an exception if glfw does not initialize
-        if not glfw.init():
-            raise Exception('[core/Window] Could not initialize GLFW!')
-        
+
         # Set window parameters
         self.params = {
             "width": 800,
             "height": 800,
-            "title": "Untitled"
+            "title": "Untitled",
+            "backend": "glfw", # A key of core.backends.BACKENDS, or a backend instance
+            "frames": None, # Stop the mainloop after this many frames
+            "duration": None, # Stop the mainloop after this many seconds
+            "frame_time": None, # Simulated seconds per frame instead of the clock, for deterministic runs
+            "pacing": "vsync", # "vsync", "fps" (see target_fps), "damage" (redraw only when needed) or None to run flat out
+            "target_fps": TARGET_FPS,
+            "idle_timeout": IDLE_TIMEOUT,
+            "update_interval": UPDATE_INTERVAL,
+            "timestep": TIMESTEP,
+            "max_steps": MAX_STEPS,
+            "frame_budget": None, # Seconds the draw queue may spend per frame, None for no limit
+            "profile": False, # Start with the profiler recording, see core.profiler
+            "hud": False # Show the performance overlay, see core.hud
         }
         self.params.update(kwargs)
-        
-        # Create the window
-        self.window = glfw.create_window(
-            self.params["width"],
-            self.params["height"],
-            self.params["title"],
-            None, None
-        )
-        glfw.make_context_current(self.window)
-        
+        if self.params["profile"]:
+            PROFILER.enable()
+
+        # Create the window, and the context shared with the update thread
+        backend = self.params["backend"]
+        if isinstance(backend, str):
+            if backend not in BACKENDS:
+                raise Exception(f'[core/Window] Unknown backend {backend}!')
+            backend = BACKENDS[backend](self.params["width"], self.params["height"], self.params["title"])
+        self.backend = backend
+        self.gl = backend.gl # False for the null backend, schedule nothing GL related then
+        if self.params["pacing"] not in PACING_MODES:
+            raise Exception(f'[core/Window] Unknown pacing mode {self.params["pacing"]}!')
+
+        # Frame pacing state, events and damage() wake up an idle window
+        self.next_frame = None # Deadline of the next frame in "fps" mode
+        self.damaged = threading.Event()
+        self.damaged.set() # Draw the first frame
+        self.damage_sources = []
+        backend.on_event = self.damaged.set
+
         # Initialize required variables
-        self.draw_queue = Scheduler()
-        
-        # TODO: Inbuilt FPS Counter with smooth fps stuff
-        
-        # TODO: Start the shared context thread here
-        
+        self.step_queue = Scheduler() # Fixed timestep simulation, items with args=True get the timestep
+        self.draw_queue = Scheduler(budget=self.params["frame_budget"]) # Items with args=True get the interpolation alpha
+        self.update_queue = Scheduler(budget=self.params["update_interval"]) # Processed in the update thread
+        self.killed = False
+
+        # Fixed timestep state
+        self.accumulator = 0.0
+        self.alpha = 0.0 # How far the drawn frame is between the last two simulation steps
+        self.steps = 0 # Simulation steps ever taken
+        self.dropped_time = 0.0 # Simulation time skipped because of MAX_STEPS
+
+        # Frame time statistics, and the overlay showing them
+        self.stats = FrameStats()
+        self.hud = None
+        self.frames = 0
+        if self.params["hud"] and self.gl:
+            from core.hud import HUD # Only pull in the overlay when it is used
+            self.hud = HUD(self.stats)
+
+        # Start the shared context thread
+        logger.info('[core/Window] Starting update thread...')
+        self.context_ready = threading.Event()
+        self.context_error = None # Raised here if the thread could not make its context current
+        self.update_thread = threading.Thread(target=self.update_loop, daemon=True)
+        self.update_thread.start()
+        self.context_ready.wait()
+        if self.context_error is not None:
+            raise self.context_error
+
         logger.info('[core/Window] Window initialized successfully!')
 
-    def mainloop(self) -> None:
+    def update_loop(self) -> None:
+        """
+        The update thread, runs the update queue in the shared context.
+        Mesh builds and buffer uploads happen here, off the render thread.
+        """
+        try:
+            self.backend.make_shared_current()
+        except BaseException as error:
+            self.context_error = error
+            return
+        finally:
+            self.context_ready.set()
+
+        while not self.killed:
+            start = time.perf_counter()
+
+            # An exception must not kill the thread, or nothing would ever be uploaded again
+            try:
+                self.update_queue.process()
+            except Exception:
+                logger.exception('[core/Window] Error in the update thread!')
+
+            # Wake an idle window as soon as the update produced something to show
+            if self.params["pacing"] == "damage" and not self.damaged.is_set() and self.is_damaged():
+                self.damage()
+
+            # Don't spin when there is nothing to do
+            remaining = self.params["update_interval"] - (time.perf_counter() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+
+        self.backend.release_current()
+
+    def step(self, frame_time) -> int:
         """
-        Starts the mainloop.
+        Run as many fixed simulation steps as the elapsed time asks for, up to max_steps.
+        Returns the number of steps taken and updates the interpolation alpha.
         """
-        glfw.make_context_current(self.window)
-        logger.info('[core/Window] Starting mainloop...')
-        while not glfw.window_should_close(self.window):
-            self.draw_queue.process()
+        timestep = self.params["timestep"]
+        self.accumulator += frame_time
+        steps = 0
+        while self.accumulator >= timestep and steps < self.params["max_steps"]:
+            self.step_queue.process(timestep)
+            self.accumulator -= timestep
+            steps += 1
+
+        # Too far behind, let the world slow down instead of trying to catch up forever
+        if self.accumulator >= timestep:
+            self.dropped_time += self.accumulator - self.accumulator % timestep
+            self.accumulator %= timestep
+
+        self.steps += steps
+        self.alpha = self.accumulator / timestep
+        return steps
+
+    def frame(self) -> None:
+        """
+        One pass of the mainloop: the simulation steps, then drawing with the alpha
+        """
+        start = time.perf_counter()
+        frame_time = self.stats.tick(start)
+        if self.params["frame_time"] is not None:
+            frame_time = self.params["frame_time"]
+        self.step(frame_time)
+        self.draw_queue.process(self.alpha)
+        if self.hud is not None:
+            self.hud.draw(*self.backend.framebuffer_size)
+
+        # Recorded by hand, the spans cost nothing while the profiler is off
+        backend = self.backend
+        if PROFILER.enabled:
+            swap = time.perf_counter()
+            backend.swap_buffers()
+            poll = time.perf_counter()
+            backend.poll_events()
+            end = time.perf_counter()
+            PROFILER.record("Window.swap_buffers", swap, poll)
+            PROFILER.record("Window.poll_events", poll, end)
+            PROFILER.record("Window.frame", start, end)
+        else:
+            backend.swap_buffers()
+            backend.poll_events()
+        self.frames += 1
+
+    def damage(self) -> None:
+        """
+        Ask for a redraw in the "damage" pacing mode, callable from any thread
+        """
+        self.damaged.set()
+        self.backend.wake()
+
+    def add_damage_source(self, source) -> None:
+        """
+        Register a callable returning whether the scene needs a redraw, e.g. Renderer.needs_redraw.
+        Sources are polled after every pass of the update thread and by an idle window.
+        """
+        self.damage_sources.append(source)
+
+    def is_damaged(self) -> bool:
+        """
+        Whether anything asked for a redraw since the last frame
+        """
+        return self.damaged.is_set() or any(source() for source in self.damage_sources)
+
+    def wait_for_damage(self, start) -> None:
+        """
+        Block on window events until something needs a redraw, the idle time is left out of the frame stats.
+        The simulation does not advance while idle.
+        """
+        waited = time.perf_counter()
+        while not self.is_damaged() and self.running(start):
+            self.backend.wait_events(self.params["idle_timeout"])
+        self.damaged.clear()
+        self.stats.skip(time.perf_counter() - waited)
+
+    def pace(self) -> None:
+        """
+        Wait for the deadline of the next frame in the "fps" pacing mode.
+        Sleeping is coarse, so it stops a little early and the rest is spun away.
+        """
+        period = 1 / self.params["target_fps"]
+        now = time.perf_counter()
+        if self.next_frame is None or now - self.next_frame > period:
+            self.next_frame = now # Late by more than a frame, don't try to catch up
+        self.next_frame += period
+
+        remaining = self.next_frame - time.perf_counter() - SPIN_MARGIN
+        if remaining > 0:
+            time.sleep(remaining)
+        while time.perf_counter() < self.next_frame:
+            pass
+
+    def running(self, start) -> bool:
+        """
+        Whether the mainloop should go on, given the time it started
+        """
+        if self.backend.should_close():
+            return False
+        if self.params["frames"] is not None and self.frames >= self.params["frames"]:
+            return False
+        if self.params["duration"] is not None and time.perf_counter() - start >= self.params["duration"]:
+            return False
+        return True
+
+    def mainloop(self) -> dict:
+        """
+        Starts the mainloop, until the window is closed or the frame count or duration is reached.
+        Returns the frame statistics of the run.
+        """
+        self.backend.make_current()
+        pacing = self.params["pacing"]
+        self.backend.set_swap_interval(1 if pacing in ("vsync", "damage") else 0)
+        logger.info(f'[core/Window] Starting mainloop, pacing: {pacing}')
+        start = time.perf_counter()
+        while self.running(start):
+            if pacing == "damage":
+                self.wait_for_damage(start)
+                if not self.running(start):
+                    break
+            self.frame()
+            if pacing == "fps":
+                self.pace()
 
-            glfw.swap_buffers(self.window)
-            glfw.poll_events()
-            
         # Cleanup
-        logger.info('[core/Window] Closed! Destroying window, cleaning up...')
-        glfw.destroy_window(self.window)
-        glfw.terminate()
+        logger.info('[core/Window] Closed! Stopping update thread...')
+        self.killed = True
+        self.update_thread.join()
+        self.step_queue.shutdown()
+        self.draw_queue.shutdown()
+        self.update_queue.shutdown()
+
+        logger.info('[core/Window] Destroying window, cleaning up...')
+        self.backend.destroy()
+        return self.stats.stats
 
     @property
-    def size(self) -> tuple: return glfw.get_window_size(self.window)
+    def size(self) -> tuple: return self.backend.size
@@ -4,8 +4,10 @@ from core.renderer import Renderer
 
 # Initialization
 window = Window()
-renderer = Renderer()
-render_task = window.draw_queue.add(renderer, "draw")
+renderer = Renderer(gl=window.gl)
+render_task = window.draw_queue.add(renderer, "draw") if window.gl else None
+update_task = window.update_queue.add(renderer, "update", budgeted=True)
+window.add_damage_source(lambda: renderer.needs_redraw)
 
 # Driver code
 if __name__ == "__main__":